@@ -0,0 +1,82 @@
+import os
+from dataclasses import dataclass, field, replace
+from typing import Any
+from dacite import Config, from_dict
+
+from ..enums.imap_encryption_mode import ImapEncryptionMode
+from ..enums.catalog_format import CatalogFormat
+from ..enums.storage_type import StorageType
+from .default_values import ImapDumpConfigDefaults
+from .imapdump_config import ImapDumpConfig
+
+
+@dataclass
+class ImapDumpAccountsFileConfig:
+    accounts: list[dict[str, Any]]
+    defaults: dict[str, Any] = field(default_factory=dict)
+
+    max_connections: int = ImapDumpConfigDefaults.MAX_CONNECTIONS
+    max_connections_per_host: int = ImapDumpConfigDefaults.MAX_CONNECTIONS_PER_HOST
+    max_write_bytes_per_second: int = ImapDumpConfigDefaults.MAX_WRITE_BYTES_PER_SECOND
+    report_file: str = ImapDumpConfigDefaults.REPORT_FILE
+
+    def account_configs(self, base: ImapDumpConfig) -> dict[str, ImapDumpConfig]:
+        """
+        Builds one config per account by layering the shared defaults and the account's own settings on top of the given base config.
+        Accounts without an explicit dump folder, database file or catalog folder get their own one derived from the account name.
+        """
+        if self.max_connections < 1 or self.max_connections_per_host < 1:
+            raise ValueError("Connection limits have to be at least 1")
+
+        base_dump_folder = self.defaults.get("dump_folder", base.dump_folder)
+        base_database_file = self.defaults.get("database_file", base.database_file)
+        base_catalog_folder = self.defaults.get("catalog_folder", base.catalog_folder)
+        database_file_root, database_file_ext = os.path.splitext(base_database_file)
+
+        configs = {}
+
+        for account in self.accounts:
+            settings = {**self.defaults, **account}
+            name = settings.pop("name", None)
+
+            if not name:
+                raise ValueError("Every account needs a 'name'")
+
+            if name in configs:
+                raise ValueError(f"Duplicate account name '{name}'")
+
+            if "dump_folder" not in account:
+                settings["dump_folder"] = os.path.join(base_dump_folder, name)
+
+            if base_catalog_folder and "catalog_folder" not in account:
+                settings["catalog_folder"] = os.path.join(base_catalog_folder, name)
+
+            if "database_file" not in account:
+                settings["database_file"] = (
+                    f"{database_file_root}-{name}{database_file_ext}"
+                )
+
+            parsed = from_dict(
+                data_class=ImapDumpConfig,
+                data=settings,
+                config=Config(
+                    cast=[ImapEncryptionMode, CatalogFormat, StorageType], strict=True
+                ),
+            )
+
+            config = replace(base)
+            for key in settings.keys():
+                setattr(config, key, getattr(parsed, key))
+
+            configs[name] = config
+
+        for key in ["dump_folder", "database_file", "catalog_folder"]:
+            paths = [
+                os.path.abspath(getattr(c, key))
+                for c in configs.values()
+                if getattr(c, key)
+            ]
+            if len(paths) != len(set(paths)):
+                raise ValueError(f"Accounts have to use distinct values for '{key}'")
+
+        return configs
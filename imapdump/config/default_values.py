@@ -1,5 +1,7 @@
 import logging
 from ..enums.imap_encryption_mode import ImapEncryptionMode
+from ..enums.catalog_format import CatalogFormat
+from ..enums.storage_type import StorageType
 
 
 class ImapDumpConfigDefaults:
@@ -19,3 +21,48 @@ class ImapDumpConfigDefaults:
     MIRROR: bool = False
     DRY_RUN: bool = False
     ADDITIONAL_CONFIG_FILES: list[str] = []
+    VERIFY_WORKERS: int = 0
+    FULLTEXT_INDEX: bool = False
+    SEARCH_LIMIT: int = 20
+
+    # storage backend
+    STORAGE: StorageType = StorageType.LOCAL
+    S3_BUCKET: str = None
+    S3_ENDPOINT_URL: str = None
+    S3_REGION: str = None
+    UPLOAD_WORKERS: int = 16
+    MULTIPART_THRESHOLD: int = 8 * 1024 * 1024
+
+    # attachment deduplication
+    DEDUP_ATTACHMENTS: bool = False
+    ATTACHMENT_MIN_SIZE: int = 65536
+
+    # metadata catalog
+    CATALOG_FOLDER: str = None
+    CATALOG_FORMAT: CatalogFormat = CatalogFormat.PARQUET
+
+    # adaptive batching
+    BATCH_SIZE_MIN: int = 50
+    BATCH_SIZE_MAX: int = 5000
+    BATCH_TARGET_SECONDS: float = 5.0
+
+    # server side search filters
+    SEARCH_SINCE: str = None
+    SEARCH_BEFORE: str = None
+    SEARCH_LARGER: int = None
+    SEARCH_SMALLER: int = None
+    SEARCH_UNSEEN: bool = False
+    SEARCH_HEADERS: list[str] = []
+
+    # distributed mode
+    COORDINATION_FILE: str = None
+    NODE_ID: str = None
+    COORDINATION_RUN: str = None
+    UID_RANGE_SIZE: int = 0
+    LEASE_SECONDS: int = 600
+
+    # multi-account scheduling
+    MAX_CONNECTIONS: int = 8
+    MAX_CONNECTIONS_PER_HOST: int = 4
+    MAX_WRITE_BYTES_PER_SECOND: int = 0
+    REPORT_FILE: str = None
@@ -1,4 +1,6 @@
 from ..enums.imap_encryption_mode import ImapEncryptionMode
+from ..enums.catalog_format import CatalogFormat
+from ..enums.storage_type import StorageType
 from .default_values import ImapDumpConfigDefaults
 from dataclasses import dataclass, asdict, field
 
@@ -15,6 +17,34 @@ class ImapDumpConfig:
     encryption_mode: ImapEncryptionMode = ImapDumpConfigDefaults.ENCRYPTION_MODE
     folder_regex: str = ImapDumpConfigDefaults.FOLDER_REGEX
     dump_folder: str = ImapDumpConfigDefaults.DUMP_FOLDER
+    storage: StorageType = ImapDumpConfigDefaults.STORAGE
+    s3_bucket: str = ImapDumpConfigDefaults.S3_BUCKET
+    s3_endpoint_url: str = ImapDumpConfigDefaults.S3_ENDPOINT_URL
+    s3_region: str = ImapDumpConfigDefaults.S3_REGION
+    upload_workers: int = ImapDumpConfigDefaults.UPLOAD_WORKERS
+    multipart_threshold: int = ImapDumpConfigDefaults.MULTIPART_THRESHOLD
+    coordination_file: str = ImapDumpConfigDefaults.COORDINATION_FILE
+    node_id: str = ImapDumpConfigDefaults.NODE_ID
+    coordination_run: str = ImapDumpConfigDefaults.COORDINATION_RUN
+    uid_range_size: int = ImapDumpConfigDefaults.UID_RANGE_SIZE
+    lease_seconds: int = ImapDumpConfigDefaults.LEASE_SECONDS
+    fulltext_index: bool = ImapDumpConfigDefaults.FULLTEXT_INDEX
+    verify_workers: int = ImapDumpConfigDefaults.VERIFY_WORKERS
+    dedup_attachments: bool = ImapDumpConfigDefaults.DEDUP_ATTACHMENTS
+    attachment_min_size: int = ImapDumpConfigDefaults.ATTACHMENT_MIN_SIZE
+    catalog_folder: str = ImapDumpConfigDefaults.CATALOG_FOLDER
+    catalog_format: CatalogFormat = ImapDumpConfigDefaults.CATALOG_FORMAT
+    batch_size_min: int = ImapDumpConfigDefaults.BATCH_SIZE_MIN
+    batch_size_max: int = ImapDumpConfigDefaults.BATCH_SIZE_MAX
+    batch_target_seconds: float = ImapDumpConfigDefaults.BATCH_TARGET_SECONDS
+    search_since: str = ImapDumpConfigDefaults.SEARCH_SINCE
+    search_before: str = ImapDumpConfigDefaults.SEARCH_BEFORE
+    search_larger: int = ImapDumpConfigDefaults.SEARCH_LARGER
+    search_smaller: int = ImapDumpConfigDefaults.SEARCH_SMALLER
+    search_unseen: bool = ImapDumpConfigDefaults.SEARCH_UNSEEN
+    search_headers: list[str] = field(
+        default_factory=lambda: ImapDumpConfigDefaults.SEARCH_HEADERS
+    )
 
     additional_config_files: list[str] = field(
         default_factory=lambda: ImapDumpConfigDefaults.ADDITIONAL_CONFIG_FILES
@@ -0,0 +1,86 @@
+import os
+import sqlite3
+from dataclasses import dataclass, field
+
+
+@dataclass
+class FolderStats:
+    folder: str
+    messages: int
+    size: int
+    max_uid: int
+    last_modified: str
+
+
+@dataclass
+class LastSyncRun:
+    started: str
+    finished: str
+    success: bool
+    written: int
+    written_byte: int
+    removed: int
+
+
+@dataclass
+class CacheStats:
+    database_file: str
+    messages: int = 0
+    size: int = 0
+    last_modified: str = None
+    last_sync_run: LastSyncRun = None
+    folders: list[FolderStats] = field(default_factory=list)
+
+
+def read_cache_stats(database_file: str) -> CacheStats:
+    """
+    Reads statistics straight from the cache database without going through SQLAlchemy.
+    The database is opened read-only and is never created or migrated.
+    """
+    if not os.path.isfile(database_file):
+        raise FileNotFoundError(f"Cache database '{database_file}' doesn't exist")
+
+    stats = CacheStats(database_file=os.path.abspath(database_file))
+    connection = sqlite3.connect(f"file:{database_file}?mode=ro", uri=True)
+
+    try:
+        tables = {
+            row[0]
+            for row in connection.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table'"
+            )
+        }
+
+        if "mails" in tables:
+            for row in connection.execute(
+                """
+                SELECT folder, COUNT(*), COALESCE(SUM(size), 0), MAX(CAST(uid AS INTEGER)), MAX(modified)
+                FROM mails GROUP BY folder ORDER BY folder
+                """
+            ):
+                stats.folders.append(FolderStats(*row))
+
+            stats.messages = sum(f.messages for f in stats.folders)
+            stats.size = sum(f.size for f in stats.folders)
+            stats.last_modified = max(
+                (f.last_modified for f in stats.folders if f.last_modified),
+                default=None,
+            )
+
+        # caches of older versions don't record their runs
+        if "sync_runs" in tables:
+            row = connection.execute(
+                """
+                SELECT started, finished, success, written, written_byte, removed
+                FROM sync_runs ORDER BY id DESC LIMIT 1
+                """
+            ).fetchone()
+
+            if row:
+                stats.last_sync_run = LastSyncRun(
+                    row[0], row[1], bool(row[2]), row[3], row[4], row[5]
+                )
+    finally:
+        connection.close()
+
+    return stats
@@ -0,0 +1,188 @@
+import logging
+import os
+from urllib.parse import quote
+
+from .data_service import DataService
+from ..enums.catalog_format import CatalogFormat
+from ..models.catalog_partition import CatalogPartition
+from ..models.mail import Mail
+
+
+class CatalogWriter:
+    """
+    Maintains a columnar copy of the metadata of all cached messages, partitioned by folder and month
+    (<catalog folder>/folder=<folder>/month=<YYYY-MM>/part.parquet). Only partitions whose messages changed
+    since they were last written are rewritten, the state of every partition is tracked in the cache.
+    """
+
+    _data_service: DataService
+    _catalog_folder: str
+    _catalog_format: CatalogFormat
+    _dry_run: bool
+    _logger: logging.Logger
+
+    def __init__(
+        self,
+        data_service: DataService,
+        *,
+        catalog_folder: str,
+        catalog_format: CatalogFormat = CatalogFormat.PARQUET,
+        dry_run: bool = False,
+    ) -> None:
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError as e:
+            raise ImportError(
+                "Writing a catalog requires pyarrow, install it with 'pip install imapdump[catalog]'"
+            ) from e
+
+        self._data_service = data_service
+        self._catalog_folder = os.path.abspath(os.path.expanduser(catalog_folder))
+        self._catalog_format = CatalogFormat(catalog_format)
+        self._dry_run = dry_run
+        self._logger = logging.getLogger(__name__)
+
+    def update(self) -> tuple[int, int]:
+        """
+        Rewrites all changed partitions and removes the ones without messages.
+        Returns the number of written and removed partitions.
+        """
+        fingerprints = self._data_service.get_catalog_fingerprints()
+        partitions: dict[tuple[str, str], CatalogPartition] = {
+            (partition.folder, partition.month): partition
+            for partition in self._data_service.get_catalog_partitions()
+        }
+
+        written = 0
+        removed = 0
+
+        for key, fingerprint in sorted(fingerprints.items()):
+            folder, month = key
+            filename = self._get_filename(folder, month)
+            partition = partitions.pop(key, None)
+
+            if (
+                partition
+                and partition.fingerprint == fingerprint
+                and partition.filename == filename
+                and os.path.isfile(os.path.join(self._catalog_folder, filename))
+            ):
+                continue
+
+            mails = self._data_service.get_mails_by_partition(folder, month)
+            written += 1
+
+            if self._dry_run:
+                self._logger.info(
+                    f"Would write {len(mails)} message(s) to catalog partition '{filename}'"
+                )
+                continue
+
+            self._logger.debug(
+                f"Writing {len(mails)} message(s) to catalog partition '{filename}'"
+            )
+            self._write_partition(filename, self._to_table(mails))
+
+            if partition and partition.filename != filename:
+                self._remove_file(partition.filename)
+
+            if not partition:
+                partition = CatalogPartition()
+                partition.folder = folder
+                partition.month = month
+
+            partition.fingerprint = fingerprint
+            partition.filename = filename
+            self._data_service.save_and_commit(partition)
+
+        # partitions of which all messages are gone
+        for partition in partitions.values():
+            removed += 1
+
+            if self._dry_run:
+                self._logger.info(
+                    f"Would remove catalog partition '{partition.filename}'"
+                )
+                continue
+
+            self._remove_file(partition.filename)
+            self._data_service.remove_catalog_partition(partition)
+            self._data_service.commit()
+
+        state = "would be updated" if self._dry_run else "is up to date"
+        self._logger.info(
+            f"Catalog '{self._catalog_folder}' {state}, {written} partition(s) written, {removed} removed, "
+            f"{len(fingerprints) - written} unchanged"
+        )
+
+        return written, removed
+
+    def _get_filename(self, folder: str, month: str) -> str:
+        # hive style partitioning, understood by DuckDB, Polars, Spark and pyarrow.dataset
+        extension = (
+            "parquet" if self._catalog_format == CatalogFormat.PARQUET else "arrow"
+        )
+        return os.path.join(
+            f"folder={quote(folder, safe='')}", f"month={month}", f"part.{extension}"
+        )
+
+    def _to_table(self, mails: list[Mail]):
+        import pyarrow as pa
+
+        return pa.table(
+            {
+                "id": pa.array([mail.id for mail in mails], pa.string()),
+                "folder": pa.array([mail.folder for mail in mails], pa.string()),
+                "uid": pa.array([int(mail.uid) for mail in mails], pa.int64()),
+                "size": pa.array([mail.size for mail in mails], pa.int64()),
+                "internal_date": pa.array(
+                    [mail.date for mail in mails], pa.timestamp("us")
+                ),
+                "subject": pa.array(
+                    [mail.title.strip() for mail in mails], pa.string()
+                ),
+                "sender": pa.array([mail.sender for mail in mails], pa.string()),
+                "recipients": pa.array(
+                    [mail.recipients for mail in mails], pa.string()
+                ),
+                "path": pa.array([mail.path for mail in mails], pa.string()),
+                "content_hash": pa.array(
+                    [mail.content_hash for mail in mails], pa.string()
+                ),
+                "modified": pa.array(
+                    [mail.modified for mail in mails], pa.timestamp("us")
+                ),
+            }
+        )
+
+    def _write_partition(self, filename: str, table):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        full_filename = os.path.join(self._catalog_folder, filename)
+        temp_filename = f"{full_filename}.tmp"
+        os.makedirs(os.path.dirname(full_filename), exist_ok=True)
+
+        if self._catalog_format == CatalogFormat.PARQUET:
+            pq.write_table(table, temp_filename, compression="zstd")
+        else:
+            with pa.OSFile(temp_filename, "wb") as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+
+        # readers never see a half written partition
+        os.replace(temp_filename, full_filename)
+
+    def _remove_file(self, filename: str):
+        full_filename = os.path.join(self._catalog_folder, filename)
+
+        if os.path.isfile(full_filename):
+            os.remove(full_filename)
+
+        # clean up the now empty partition directories
+        directory = os.path.dirname(full_filename)
+        while directory != self._catalog_folder and os.path.isdir(directory):
+            if os.listdir(directory):
+                break
+            os.rmdir(directory)
+            directory = os.path.dirname(directory)
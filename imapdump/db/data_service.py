@@ -1,16 +1,40 @@
+import contextlib
 import logging
 import os
 import sqlite3
-from sqlalchemy import URL, create_engine, Engine, select, delete
+from sqlalchemy import (
+    URL,
+    create_engine,
+    event,
+    Connection,
+    Engine,
+    select,
+    delete,
+    text,
+    inspect,
+    table,
+    column,
+)
 from sqlalchemy.orm import Session
 
 from ..models.mail import Base, Mail
+from ..models.host_tuning import HostTuning
+from ..models.catalog_partition import CatalogPartition
+from ..models.attachment import Attachment, MailAttachment
+from ..models.sync_run import SyncRun  # noqa: F401 (registers the table)
 
 
 class DataService:
     __engine: Engine = None
     __session = None
+    __dry_run_connection: Connection = None
     _logger: logging.Logger
+    _fulltext_index: bool = False
+
+    PARAMETER_CHUNKSIZE: int = 10000
+
+    # messages without an INTERNALDATE end up in their own partition of the catalog
+    CATALOG_MONTH: str = "COALESCE(strftime('%Y-%m', date), 'unknown')"
 
     def __init__(
         self,
@@ -18,6 +42,7 @@ class DataService:
         connection_string: str | URL = "sqlite://",
         recreate: bool = False,
         dry_run: bool = False,
+        fulltext_index: bool = False,
     ) -> None:
         self._logger = logging.getLogger(__name__)
         self._logger.info(
@@ -27,37 +52,167 @@ class DataService:
         # only echo SQL statements if we're logging at the debug level
         echo = self._logger.getEffectiveLevel() <= logging.DEBUG
 
-        existing_db = None
         if dry_run:
             # bruh this is some C++ style substring handling
             existing_db_file = connection_string[len("sqlite:///") :]
-            connection_string = "sqlite:///:memory:"
-            if os.path.isfile(existing_db_file):
-                existing_db = sqlite3.connect(existing_db_file)
+            if not os.path.isfile(existing_db_file):
+                connection_string = "sqlite:///:memory:"
 
         self.__engine = create_engine(connection_string, echo=echo)
 
-        if existing_db:
+        if dry_run:
             self._logger.info(
-                f"Copying existing database into in-memory db for dry run"
+                "Using existing database for dry run, all changes will be rolled back"
             )
-            conn = self.__engine.raw_connection().dbapi_connection
-            existing_db.backup(conn)
-            existing_db.close()
+            self.__start_dry_run()
+
+        bind = self.__dry_run_connection or self.__engine
 
         if recreate:
-            Base.metadata.drop_all(self.__engine)
+            Base.metadata.drop_all(bind)
+            with self._begin() as connection:
+                connection.execute(text("DROP TABLE IF EXISTS mails_fts"))
+                connection.execute(text("DROP TABLE IF EXISTS mails_fts_docs"))
             self._logger.info("Dropped existing database")
 
-        Base.metadata.create_all(self.__engine)
-        self.__session = Session(self.__engine)
+        Base.metadata.create_all(bind)
+        self._add_missing_columns()
+
+        if self.__dry_run_connection:
+            # commits only release a savepoint, the surrounding transaction is never committed
+            self.__session = Session(
+                bind=self.__dry_run_connection, join_transaction_mode="create_savepoint"
+            )
+        else:
+            self.__session = Session(self.__engine)
+
+        self._fill_missing_paths()
+
+        # keep an existing index up to date even if it isn't used by this run
+        if fulltext_index or inspect(bind).has_table("mails_fts_docs"):
+            self._create_fulltext_index()
 
         assert self.__engine is not None
         assert self.__session is not None
 
+    def __start_dry_run(self):
+        """
+        Opens a single connection to the real database and starts a transaction that is rolled back when closing.
+        The rollback journal is kept in memory and changed pages are never spilled to the database file,
+        so the cost of a dry run grows with the number of changes instead of the size of the cache.
+        """
+
+        @event.listens_for(self.__engine, "connect")
+        def on_connect(dbapi_connection, connection_record):
+            # let SQLAlchemy emit BEGIN itself, otherwise the driver would run DDL outside of the transaction
+            dbapi_connection.isolation_level = None
+
+            cursor = dbapi_connection.cursor()
+            if cursor.execute("PRAGMA journal_mode").fetchone()[0].lower() != "wal":
+                cursor.execute("PRAGMA journal_mode = MEMORY")
+            cursor.execute("PRAGMA cache_spill = OFF")
+            cursor.close()
+
+        @event.listens_for(self.__engine, "begin")
+        def on_begin(connection):
+            connection.exec_driver_sql("BEGIN")
+
+        self.__dry_run_connection = self.__engine.connect()
+        self.__dry_run_connection.begin()
+
+    @contextlib.contextmanager
+    def _begin(self):
+        if self.__dry_run_connection:
+            yield self.__dry_run_connection
+        else:
+            with self.__engine.begin() as connection:
+                yield connection
+
+    def _add_missing_columns(self):
+        """
+        Brings caches created by older versions up to date by adding columns that were introduced since.
+        Only works for nullable columns, which all new columns have to be.
+        """
+        with self._begin() as connection:
+            inspector = inspect(connection)
+
+            for table in Base.metadata.sorted_tables:
+                existing_columns = {
+                    column["name"] for column in inspector.get_columns(table.name)
+                }
+
+                for column in table.columns:
+                    if column.name in existing_columns:
+                        continue
+
+                    column_type = column.type.compile(dialect=self.__engine.dialect)
+                    self._logger.info(
+                        f"Adding missing column '{column.name}' to table '{table.name}'"
+                    )
+                    connection.execute(
+                        text(
+                            f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"
+                        )
+                    )
+
+                # indexes of added columns
+                for index in table.indexes:
+                    index.create(connection, checkfirst=True)
+
+    def _fill_missing_paths(self):
+        """
+        Stores the path of messages cached by older versions, which derived it from the title on every run
+        """
+        select_statement = select(Mail).where(Mail.path.is_(None))
+        mails = self.__session.scalars(select_statement).all()
+
+        if not mails:
+            return
+
+        self._logger.info(f"Storing the path of {len(mails)} cached message(s)")
+
+        for mail in mails:
+            mail.path = Mail.generate_path(mail.folder, mail.id, mail.title)
+
+        self.commit()
+
+    def _create_fulltext_index(self):
+        # FTS5 rowids are integers, so the mail ids are mapped to them through a separate table
+        self.__session.execute(
+            text(
+                """
+                CREATE TABLE IF NOT EXISTS mails_fts_docs (
+                    rowid INTEGER PRIMARY KEY,
+                    mail_id TEXT NOT NULL UNIQUE
+                )
+                """
+            )
+        )
+        self.__session.execute(
+            text(
+                """
+                CREATE VIRTUAL TABLE IF NOT EXISTS mails_fts USING fts5(
+                    subject, addresses, body, attachments,
+                    tokenize = 'unicode61 remove_diacritics 2'
+                )
+                """
+            )
+        )
+        self.commit()
+        self._fulltext_index = True
+
+    @property
+    def has_fulltext_index(self) -> bool:
+        return self._fulltext_index
+
     def close_db(self):
         self._logger.info("Shutting down")
         self.__session.invalidate()
+
+        if self.__dry_run_connection:
+            self.__dry_run_connection.rollback()
+            self.__dry_run_connection.close()
+
         self.__engine.dispose()
 
     def get_all_mails(self) -> list[Mail]:
@@ -73,21 +228,73 @@ class DataService:
 
         return self.__session.scalars(select_statement).one_or_none()
 
-    def get_or_create_mail_by_id(self, id) -> Mail | None:
-        select_statement = select(Mail).where(Mail.id.is_(id))
+    def get_mails_by_ids(self, ids: list[str]) -> list[Mail]:
+        mails = []
+
+        # stay below SQLite's limit of bound parameters per statement
+        for start in range(0, len(ids), self.PARAMETER_CHUNKSIZE):
+            select_statement = select(Mail).where(
+                Mail.id.in_(ids[start : start + self.PARAMETER_CHUNKSIZE])
+            )
+            mails.extend(self.__session.scalars(select_statement).all())
 
-        mail = self.__session.scalars(select_statement).one_or_none()
+        return mails
 
-        if not mail:
-            mail = Mail()
-            mail.id = id
+    def get_host_tuning(self, host: str, phase: str) -> HostTuning | None:
+        select_statement = select(HostTuning).where(
+            HostTuning.host == host, HostTuning.phase == phase
+        )
+
+        return self.__session.scalars(select_statement).one_or_none()
+
+    def save_host_tuning(
+        self, host: str, phase: str, batch_size: int, bytes_per_second: float
+    ):
+        tuning = self.get_host_tuning(host, phase)
+
+        if not tuning:
+            tuning = HostTuning()
+            tuning.host = host
+            tuning.phase = phase
+
+        tuning.batch_size = batch_size
+        tuning.bytes_per_second = bytes_per_second
+        self.save_and_commit(tuning)
+
+    def get_catalog_fingerprints(self) -> dict[tuple[str, str], str]:
+        """
+        Returns a fingerprint of every (folder, month) partition of the cache that changes whenever a message
+        of the partition is added, removed or updated
+        """
+        rows = self.__session.execute(
+            text(
+                f"""
+                SELECT folder, {self.CATALOG_MONTH}, COUNT(*), MAX(modified), SUM(size), SUM(CAST(uid AS INTEGER))
+                FROM mails GROUP BY folder, {self.CATALOG_MONTH}
+                """
+            )
+        )
 
-        return mail
+        return {
+            (folder, month): ":".join(str(value) for value in values)
+            for folder, month, *values in rows
+        }
 
-    def mail_has_to_be_created_or_updated(self, id, size: int) -> bool:
-        mail = self.get_mail_by_id(id)
+    def get_catalog_partitions(self) -> list[CatalogPartition]:
+        select_statement = select(CatalogPartition)
+        return self.__session.scalars(select_statement).all()
+
+    def get_mails_by_partition(self, folder: str, month: str) -> list[Mail]:
+        select_statement = (
+            select(Mail)
+            .where(Mail.folder == folder, text(f"{self.CATALOG_MONTH} = :month"))
+            .params(month=month)
+            .order_by(text("CAST(uid AS INTEGER)"))
+        )
+        return self.__session.scalars(select_statement).all()
 
-        return mail is None or mail.size != size
+    def remove_catalog_partition(self, partition: CatalogPartition):
+        self.__session.delete(partition)
 
     def save_and_commit(self, object):
         self.save(object)
@@ -106,6 +313,7 @@ class DataService:
         """
         delete_statement = delete(Mail).where(Mail.id.not_in(ids))
         self.__session.execute(delete_statement)
+        self._remove_orphaned_index_entries()
         self.commit()
 
     def save(self, object):
@@ -114,8 +322,206 @@ class DataService:
     def remove_all_mails(self):
         delete_statement = delete(Mail)
         self.__session.execute(delete_statement)
+        self._remove_orphaned_index_entries()
         self.commit()
 
+    def index_mail(self, mail_id: str, document: dict[str, str]):
+        """
+        Adds the given search document to the full text index, replacing an existing entry of the mail
+        """
+        self.__session.execute(
+            text("INSERT OR IGNORE INTO mails_fts_docs (mail_id) VALUES (:mail_id)"),
+            {"mail_id": mail_id},
+        )
+        rowid = self.__session.execute(
+            text("SELECT rowid FROM mails_fts_docs WHERE mail_id = :mail_id"),
+            {"mail_id": mail_id},
+        ).scalar_one()
+
+        self.__session.execute(
+            text("DELETE FROM mails_fts WHERE rowid = :rowid"), {"rowid": rowid}
+        )
+        self.__session.execute(
+            text(
+                """
+                INSERT INTO mails_fts (rowid, subject, addresses, body, attachments)
+                VALUES (:rowid, :subject, :addresses, :body, :attachments)
+                """
+            ),
+            {"rowid": rowid, **document},
+        )
+
+    def get_unindexed_mails(self) -> list[Mail]:
+        fts_docs = table("mails_fts_docs", column("mail_id"))
+        select_statement = select(Mail).where(
+            Mail.id.not_in(select(fts_docs.c.mail_id))
+        )
+        return self.__session.scalars(select_statement).all()
+
+    def save_mail_attachments(self, mail_id: str, attachments: dict[str, int]):
+        """
+        Replaces the attachments (digest -> size) a message references in the attachment store
+        """
+        self.__session.execute(
+            delete(MailAttachment).where(MailAttachment.mail_id == mail_id)
+        )
+
+        for digest, size in attachments.items():
+            self.__session.execute(
+                text(
+                    "INSERT OR IGNORE INTO attachments (digest, size, created) VALUES (:digest, :size, CURRENT_TIMESTAMP)"
+                ),
+                {"digest": digest, "size": size},
+            )
+
+            mail_attachment = MailAttachment()
+            mail_attachment.mail_id = mail_id
+            mail_attachment.digest = digest
+            self.__session.add(mail_attachment)
+
+    def get_attachment_digests(self, mail_ids: list[str]) -> list[str]:
+        digests = set()
+
+        for start in range(0, len(mail_ids), self.PARAMETER_CHUNKSIZE):
+            select_statement = select(MailAttachment.digest).where(
+                MailAttachment.mail_id.in_(
+                    mail_ids[start : start + self.PARAMETER_CHUNKSIZE]
+                )
+            )
+            digests.update(self.__session.scalars(select_statement).all())
+
+        return list(digests)
+
+    def remove_orphaned_attachments(self) -> list[Attachment]:
+        """
+        Forgets all attachments that no cached message references anymore and returns them
+        """
+        self.__session.execute(
+            delete(MailAttachment).where(MailAttachment.mail_id.not_in(select(Mail.id)))
+        )
+
+        select_statement = select(Attachment).where(
+            Attachment.digest.not_in(select(MailAttachment.digest))
+        )
+        orphans = self.__session.scalars(select_statement).all()
+
+        for orphan in orphans:
+            self.__session.delete(orphan)
+
+        self.commit()
+        return orphans
+
+    def _remove_orphaned_index_entries(self):
+        if not self._fulltext_index:
+            return
+
+        orphans = "SELECT rowid FROM mails_fts_docs WHERE mail_id NOT IN (SELECT id FROM mails)"
+        self.__session.execute(
+            text(f"DELETE FROM mails_fts WHERE rowid IN ({orphans})")
+        )
+        self.__session.execute(
+            text(f"DELETE FROM mails_fts_docs WHERE rowid IN ({orphans})")
+        )
+
+    def merge_caches(self, database_files: list[str]):
+        """
+        Merges the mails and the attachment references of the given cache databases (e.g. of several nodes in distributed mode) into this one.
+        Rows of later databases win over earlier ones.
+        """
+
+        for database_file in database_files:
+            if self.__dry_run_connection:
+                # databases can't be attached inside of the dry run's transaction
+                source = sqlite3.connect(f"file:{database_file}?mode=ro", uri=True)
+                count = source.execute("SELECT COUNT(*) FROM mails").fetchone()[0]
+                source.close()
+                self._logger.info(
+                    f"Would merge {count} message(s) from cache '{database_file}'"
+                )
+                continue
+
+            self._logger.info(f"Merging cache '{database_file}'")
+
+            # attaching only applies to a single connection, the session may switch connections when committing
+            with self.__engine.connect() as connection:
+                connection.execute(
+                    text("ATTACH DATABASE :file AS node"), {"file": database_file}
+                )
+                try:
+                    node_tables = connection.scalars(
+                        text("SELECT name FROM node.sqlite_master WHERE type = 'table'")
+                    ).all()
+
+                    if "mails_fts_docs" in node_tables and not self._fulltext_index:
+                        self._create_fulltext_index()
+
+                    for model in [Mail, Attachment, MailAttachment]:
+                        if model.__tablename__ not in node_tables:
+                            continue
+
+                        columns = ", ".join(
+                            column.name for column in model.__table__.columns
+                        )
+                        result = connection.execute(
+                            text(
+                                f"INSERT OR REPLACE INTO main.{model.__tablename__} ({columns}) "
+                                f"SELECT {columns} FROM node.{model.__tablename__}"
+                            )
+                        )
+                        self._logger.info(
+                            f"Merged {result.rowcount} row(s) into '{model.__tablename__}'"
+                        )
+
+                    if "mails_fts_docs" in node_tables:
+                        self._merge_fulltext_index(connection)
+
+                    connection.commit()
+                finally:
+                    connection.rollback()
+                    connection.execute(text("DETACH DATABASE node"))
+                    connection.commit()
+
+        self.__session.expire_all()
+
+        if self._fulltext_index and not self.__dry_run_connection:
+            unindexed = len(self.get_unindexed_mails())
+            if unindexed > 0:
+                self._logger.info(
+                    f"{unindexed} merged message(s) aren't in the full text index yet, they're added by the next dump"
+                )
+
+    def _merge_fulltext_index(self, connection: Connection):
+        """
+        Copies the search documents of the attached node cache, replacing the entries of the merged mails
+        """
+        connection.execute(
+            text(
+                "INSERT OR IGNORE INTO main.mails_fts_docs (mail_id) SELECT mail_id FROM node.mails_fts_docs"
+            )
+        )
+        connection.execute(
+            text(
+                """
+                DELETE FROM main.mails_fts WHERE rowid IN (
+                    SELECT m.rowid FROM main.mails_fts_docs m
+                    JOIN node.mails_fts_docs n ON n.mail_id = m.mail_id
+                )
+                """
+            )
+        )
+        result = connection.execute(
+            text(
+                """
+                INSERT INTO main.mails_fts (rowid, subject, addresses, body, attachments)
+                SELECT m.rowid, f.subject, f.addresses, f.body, f.attachments
+                FROM node.mails_fts f
+                JOIN node.mails_fts_docs n ON n.rowid = f.rowid
+                JOIN main.mails_fts_docs m ON m.mail_id = n.mail_id
+                """
+            )
+        )
+        self._logger.info(f"Merged {result.rowcount} row(s) into the full text index")
+
     def commit(self):
         self.__session.commit()
         self.__session.flush()
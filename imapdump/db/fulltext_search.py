@@ -0,0 +1,73 @@
+import os
+import sqlite3
+from dataclasses import dataclass
+
+
+@dataclass
+class SearchResult:
+    date: str
+    folder: str
+    title: str
+    path: str
+    snippet: str
+
+
+def search_cache(database_file: str, query: str, limit: int) -> list[SearchResult]:
+    """
+    Runs a full text query (FTS5 syntax) against the index of the cache database.
+    Returns the best matching mails along with a snippet of the matching text.
+    The database is opened read-only, a cache without an index is never changed.
+    """
+    if not os.path.isfile(database_file):
+        raise FileNotFoundError(f"Cache database '{database_file}' doesn't exist")
+
+    connection = sqlite3.connect(f"file:{database_file}?mode=ro", uri=True)
+
+    try:
+        tables = {
+            row[0]
+            for row in connection.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table'"
+            )
+        }
+
+        if "mails_fts_docs" not in tables:
+            raise ValueError(
+                f"The full text index isn't enabled for cache '{database_file}', dump with --fulltext-index first"
+            )
+
+        columns = {row[1] for row in connection.execute("PRAGMA table_info(mails)")}
+        if "path" not in columns:
+            raise ValueError(
+                f"Cache '{database_file}' was written by an older version, dump once to update it"
+            )
+
+        try:
+            rows = connection.execute(
+                """
+                SELECT m.date, m.folder, m.title, m.path, snippet(mails_fts, -1, '[', ']', '...', 12)
+                FROM mails_fts f
+                JOIN mails_fts_docs d ON d.rowid = f.rowid
+                JOIN mails m ON m.id = d.mail_id
+                WHERE mails_fts MATCH ?
+                ORDER BY rank
+                LIMIT ?
+                """,
+                (query, limit),
+            ).fetchall()
+        except sqlite3.OperationalError as e:
+            raise ValueError(f"Invalid search query '{query}': {e}") from e
+    finally:
+        connection.close()
+
+    return [
+        SearchResult(
+            # stored as 'YYYY-MM-DD HH:MM:SS.ffffff'
+            date=date[:16] if date else "unknown date",
+            folder=folder,
+            title=(title or "").strip(),
+            path=path,
+            snippet=snippet,
+        )
+        for date, folder, title, path, snippet in rows
+    ]
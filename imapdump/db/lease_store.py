@@ -0,0 +1,223 @@
+import logging
+import sqlite3
+import time
+from dataclasses import dataclass
+
+
+@dataclass
+class LeaseUnit:
+    run: str
+    folder: str
+    uid_start: int
+    uid_end: int | None
+
+    def __str__(self) -> str:
+        return f"'{self.folder}' UID {self.uid_start}:{self.uid_end or '*'}"
+
+
+class LeaseLostError(Exception):
+    """
+    Raised when another node took over the lease of the unit this node is working on
+    """
+
+
+class LeaseStore:
+    """
+    Coordinates several imapdump instances working on the same account through a shared SQLite file.
+    Work is split into units (whole folders or UID ranges inside a folder) that nodes lease for a limited time.
+    Units of expired leases are handed out again, so a crashed node doesn't block the run.
+    """
+
+    _connection: sqlite3.Connection
+    _logger: logging.Logger
+
+    def __init__(self, filename: str) -> None:
+        self._logger = logging.getLogger(__name__)
+        self._logger.info(f"Using coordination store '{filename}'")
+
+        # autocommit mode, transactions are started explicitly
+        self._connection = sqlite3.connect(filename, timeout=60, isolation_level=None)
+        self._connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS units (
+                run TEXT NOT NULL,
+                folder TEXT NOT NULL,
+                uid_start INTEGER NOT NULL,
+                uid_end INTEGER,
+                node TEXT,
+                lease_expires REAL,
+                done INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (run, folder, uid_start)
+            );
+            CREATE TABLE IF NOT EXISTS nodes (
+                node TEXT PRIMARY KEY,
+                database_file TEXT NOT NULL,
+                dump_folder TEXT NOT NULL,
+                last_seen REAL NOT NULL
+            );
+            """
+        )
+
+    def close(self):
+        self._connection.close()
+
+    def register_node(
+        self, node: str, database_file: str, dump_folder: str, lease_seconds: int
+    ):
+        """
+        Registers the cache of a node for merging. Every node needs its own cache, a database file used by
+        another node that was active within the lease time is rejected. Registrations of nodes that are gone
+        (e.g. a crashed node restarted with a new id) are taken over.
+        """
+        self._connection.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            row = self._connection.execute(
+                "SELECT node FROM nodes WHERE database_file = ? AND node != ? AND last_seen >= ?",
+                (database_file, node, now - lease_seconds),
+            ).fetchone()
+
+            if row:
+                raise ValueError(
+                    f"Database file '{database_file}' is already used by node '{row[0]}', every node needs its own cache"
+                )
+
+            self._connection.execute(
+                "DELETE FROM nodes WHERE database_file = ? AND node != ?",
+                (database_file, node),
+            )
+            self._connection.execute(
+                "INSERT OR REPLACE INTO nodes VALUES (?, ?, ?, ?)",
+                (node, database_file, dump_folder, now),
+            )
+            self._connection.execute("COMMIT")
+        except Exception:
+            self._connection.execute("ROLLBACK")
+            raise
+
+    def finish_node(self, node: str):
+        """
+        Marks a node as no longer active, so its database file may be registered by another node
+        """
+        self._connection.execute(
+            "UPDATE nodes SET last_seen = 0 WHERE node = ?", (node,)
+        )
+
+    def get_node_database_files(self) -> dict[str, str]:
+        """
+        Returns the database file of every registered node
+        """
+        rows = self._connection.execute(
+            "SELECT node, database_file FROM nodes ORDER BY node"
+        ).fetchall()
+        return {node: database_file for node, database_file in rows}
+
+    def get_node_dump_folders(self) -> dict[str, str]:
+        """
+        Returns the dump folder of every registered node
+        """
+        rows = self._connection.execute(
+            "SELECT node, dump_folder FROM nodes ORDER BY node"
+        ).fetchall()
+        return {node: dump_folder for node, dump_folder in rows}
+
+    def register_units(self, units: list[LeaseUnit]):
+        """
+        Adds the given units, skipping folders that have already been split up for this run by another node
+        """
+        self._connection.execute("BEGIN IMMEDIATE")
+        try:
+            registered_folders = set()
+
+            for unit in units:
+                if unit.folder not in registered_folders:
+                    exists = self._connection.execute(
+                        "SELECT 1 FROM units WHERE run = ? AND folder = ? LIMIT 1",
+                        (unit.run, unit.folder),
+                    ).fetchone()
+
+                    if exists:
+                        continue
+
+                    registered_folders.add(unit.folder)
+
+                self._connection.execute(
+                    "INSERT INTO units (run, folder, uid_start, uid_end) VALUES (?, ?, ?, ?)",
+                    (unit.run, unit.folder, unit.uid_start, unit.uid_end),
+                )
+            self._connection.execute("COMMIT")
+        except Exception:
+            self._connection.execute("ROLLBACK")
+            raise
+
+    def claim(self, run: str, node: str, lease_seconds: int) -> LeaseUnit | None:
+        """
+        Leases the next unit that is neither done nor leased by another node.
+        Units this node finished in earlier runs come first, as their messages are already in its cache,
+        followed by units no node has finished before. Units of other nodes are only taken over at the end.
+        """
+        self._connection.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            row = self._connection.execute(
+                """
+                SELECT folder, uid_start, uid_end FROM units u
+                WHERE run = ? AND done = 0 AND (node IS NULL OR node = ? OR lease_expires < ?)
+                ORDER BY COALESCE((
+                    SELECT MIN(CASE WHEN p.node = ? THEN 0 ELSE 2 END) FROM units p
+                    WHERE p.run != u.run AND p.folder = u.folder AND p.uid_start = u.uid_start AND p.done = 1
+                ), 1), folder, uid_start
+                LIMIT 1
+                """,
+                (run, node, now, node),
+            ).fetchone()
+
+            if row is None:
+                self._connection.execute("COMMIT")
+                return None
+
+            folder, uid_start, uid_end = row
+            self._connection.execute(
+                "UPDATE units SET node = ?, lease_expires = ? WHERE run = ? AND folder = ? AND uid_start = ?",
+                (node, now + lease_seconds, run, folder, uid_start),
+            )
+            self._touch_node(node, now)
+            self._connection.execute("COMMIT")
+        except Exception:
+            self._connection.execute("ROLLBACK")
+            raise
+
+        return LeaseUnit(run=run, folder=folder, uid_start=uid_start, uid_end=uid_end)
+
+    def renew(self, unit: LeaseUnit, node: str, lease_seconds: int) -> bool:
+        cursor = self._connection.execute(
+            "UPDATE units SET lease_expires = ? WHERE run = ? AND folder = ? AND uid_start = ? AND node = ?",
+            (time.time() + lease_seconds, unit.run, unit.folder, unit.uid_start, node),
+        )
+
+        if cursor.rowcount == 0:
+            self._logger.warning(f"Lost lease on {unit} to another node")
+            return False
+
+        self._touch_node(node, time.time())
+        return True
+
+    def complete(self, unit: LeaseUnit, node: str):
+        self._connection.execute(
+            "UPDATE units SET done = 1, lease_expires = NULL WHERE run = ? AND folder = ? AND uid_start = ? AND node = ?",
+            (unit.run, unit.folder, unit.uid_start, node),
+        )
+
+    def get_progress(self, run: str) -> tuple[int, int]:
+        """
+        Returns the number of finished units and the total number of units of the given run
+        """
+        done, total = self._connection.execute(
+            "SELECT COALESCE(SUM(done), 0), COUNT(*) FROM units WHERE run = ?", (run,)
+        ).fetchone()
+        return done, total
+
+    def _touch_node(self, node: str, now: float):
+        self._connection.execute(
+            "UPDATE nodes SET last_seen = ? WHERE node = ?", (now, node)
+        )
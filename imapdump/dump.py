@@ -3,16 +3,17 @@ from dataclasses import asdict
 import json
 import logging
 import os
-import yaml
-from dacite import Config, from_dict
 
 from . import __version__
-from .imap.dumper import ImapDumper
 from .enums.imap_encryption_mode import ImapEncryptionMode
+from .enums.catalog_format import CatalogFormat
+from .enums.storage_type import StorageType
 from .config.imapdump_config import ImapDumpConfig
-from .config.fileconfig import ImapDumpFileConfig
 from .config.default_values import ImapDumpConfigDefaults
 
+# SQLAlchemy, imapclient, yaml and dacite are only imported by the commands that need them,
+# so that 'status' starts quickly
+
 
 def main():
     available_levels = [
@@ -28,6 +29,34 @@ def main():
         fromfile_prefix_chars="@",
     )
 
+    parser.add_argument(
+        "command",
+        help="What to do: 'dump' the account, 'verify' the dumped files against the cache and fetch broken ones again, "
+        "'search' the full text index, 'merge' the caches of all nodes of a distributed run into the database file, "
+        "show the 'status' of the cache, 'plan' what the next dump would fetch, 'export-catalog' from the cache "
+        "or 'reassemble' messages with deduplicated attachments into complete .eml files",
+        type=str,
+        nargs="?",
+        choices=[
+            "dump",
+            "verify",
+            "search",
+            "merge",
+            "status",
+            "plan",
+            "export-catalog",
+            "reassemble",
+        ],
+        default="dump",
+    )
+
+    parser.add_argument(
+        "search_query",
+        help="Full text query when searching (FTS5 syntax, e.g. 'invoice AND subject:2024')",
+        type=str,
+        nargs="*",
+    )
+
     parser.add_argument(
         "-l",
         "--logging",
@@ -141,6 +170,229 @@ def main():
         default=ImapDumpConfigDefaults.DUMP_FOLDER,
     )
 
+    group_storage = parser.add_argument_group(
+        "object storage",
+        "Store messages in an S3 compatible bucket instead of the local disk, the dump folder is used as key prefix",
+    )
+
+    group_storage.add_argument(
+        "--storage",
+        help="Where to store dumped messages",
+        type=StorageType,
+        choices=StorageType.list(),
+        default=ImapDumpConfigDefaults.STORAGE,
+    )
+
+    group_storage.add_argument(
+        "--s3-bucket",
+        help="Bucket to store messages in",
+        type=str,
+        default=ImapDumpConfigDefaults.S3_BUCKET,
+    )
+
+    group_storage.add_argument(
+        "--s3-endpoint-url",
+        help="Endpoint of S3 compatible storage other than AWS, e.g. MinIO",
+        type=str,
+        default=ImapDumpConfigDefaults.S3_ENDPOINT_URL,
+    )
+
+    group_storage.add_argument(
+        "--s3-region",
+        help="Region of the bucket",
+        type=str,
+        default=ImapDumpConfigDefaults.S3_REGION,
+    )
+
+    group_storage.add_argument(
+        "--upload-workers",
+        help="Number of concurrent uploads",
+        type=int,
+        default=ImapDumpConfigDefaults.UPLOAD_WORKERS,
+    )
+
+    group_storage.add_argument(
+        "--multipart-threshold",
+        help="Size in bytes from which on objects are uploaded in parts",
+        type=int,
+        default=ImapDumpConfigDefaults.MULTIPART_THRESHOLD,
+    )
+
+    group_batching = parser.add_argument_group(
+        "batching",
+        "The number of messages per FETCH is tuned at runtime and remembered per host for the next run",
+    )
+
+    group_batching.add_argument(
+        "--batch-size-min",
+        help="Smallest number of messages per FETCH",
+        type=int,
+        default=ImapDumpConfigDefaults.BATCH_SIZE_MIN,
+    )
+
+    group_batching.add_argument(
+        "--batch-size-max",
+        help="Largest number of messages per FETCH",
+        type=int,
+        default=ImapDumpConfigDefaults.BATCH_SIZE_MAX,
+    )
+
+    group_batching.add_argument(
+        "--batch-target-seconds",
+        help="Round trip time a single FETCH should take",
+        type=float,
+        default=ImapDumpConfigDefaults.BATCH_TARGET_SECONDS,
+    )
+
+    group_search = parser.add_argument_group(
+        "search filters",
+        "Let the server only return matching messages, messages outside of the filter are left alone (even in mirror mode)",
+    )
+
+    group_search.add_argument(
+        "--since",
+        dest="search_since",
+        help="Only messages received on or after this date (YYYY-MM-DD or a number of days ago like '90d')",
+        type=str,
+        default=ImapDumpConfigDefaults.SEARCH_SINCE,
+    )
+
+    group_search.add_argument(
+        "--before",
+        dest="search_before",
+        help="Only messages received before this date (YYYY-MM-DD or a number of days ago like '90d')",
+        type=str,
+        default=ImapDumpConfigDefaults.SEARCH_BEFORE,
+    )
+
+    group_search.add_argument(
+        "--larger",
+        dest="search_larger",
+        help="Only messages larger than this many bytes",
+        type=int,
+        default=ImapDumpConfigDefaults.SEARCH_LARGER,
+    )
+
+    group_search.add_argument(
+        "--smaller",
+        dest="search_smaller",
+        help="Only messages smaller than this many bytes",
+        type=int,
+        default=ImapDumpConfigDefaults.SEARCH_SMALLER,
+    )
+
+    group_search.add_argument(
+        "--unseen",
+        dest="search_unseen",
+        help="Only messages that have not been read yet",
+        action="store_true",
+    )
+
+    group_search.add_argument(
+        "--header",
+        dest="search_headers",
+        help="Only messages with a header containing a value, given as 'Name: value' (can be specified multiple times)",
+        type=str,
+        action="append",
+        default=ImapDumpConfigDefaults.SEARCH_HEADERS,
+    )
+
+    group_distributed = parser.add_argument_group(
+        "distributed mode",
+        "Split a single account between several instances sharing a coordination store",
+    )
+
+    group_distributed.add_argument(
+        "--coordination-file",
+        help="SQLite file shared by all instances, enables distributed mode",
+        type=str,
+        default=ImapDumpConfigDefaults.COORDINATION_FILE,
+    )
+
+    group_distributed.add_argument(
+        "--node-id",
+        help="Name of this instance, '<hostname>-<hash of the cache file>' if unset",
+        type=str,
+        default=ImapDumpConfigDefaults.NODE_ID,
+    )
+
+    group_distributed.add_argument(
+        "--coordination-run",
+        help="Instances with the same run name share their work, required in distributed mode",
+        type=str,
+        default=ImapDumpConfigDefaults.COORDINATION_RUN,
+    )
+
+    group_distributed.add_argument(
+        "--uid-range-size",
+        help="Split folders into UID ranges of this size, 0 leases whole folders",
+        type=int,
+        default=ImapDumpConfigDefaults.UID_RANGE_SIZE,
+    )
+
+    group_distributed.add_argument(
+        "--lease-seconds",
+        help="Time after which a unit of an unresponsive instance is handed out again",
+        type=int,
+        default=ImapDumpConfigDefaults.LEASE_SECONDS,
+    )
+
+    parser.add_argument(
+        "--fulltext-index",
+        help="Maintain a full text index of subjects, addresses, text bodies and attachment names in the cache",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--dedup-attachments",
+        help="Store large base64 encoded attachments only once in a content addressed store inside of the dump folder, "
+        "messages containing them are written as skeletons referencing the store",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--attachment-min-size",
+        help="Smallest decoded size in bytes of an attachment to be deduplicated",
+        type=int,
+        default=ImapDumpConfigDefaults.ATTACHMENT_MIN_SIZE,
+    )
+
+    parser.add_argument(
+        "--catalog-folder",
+        help="Keep a Parquet/Arrow catalog of the metadata of all cached messages in this folder, partitioned by folder and month",
+        type=str,
+        default=ImapDumpConfigDefaults.CATALOG_FOLDER,
+    )
+
+    parser.add_argument(
+        "--catalog-format",
+        help="File format of the catalog partitions",
+        type=CatalogFormat,
+        choices=CatalogFormat.list(),
+        default=ImapDumpConfigDefaults.CATALOG_FORMAT,
+    )
+
+    parser.add_argument(
+        "--search-limit",
+        help="Maximum number of search results",
+        type=int,
+        default=ImapDumpConfigDefaults.SEARCH_LIMIT,
+    )
+
+    parser.add_argument(
+        "--json",
+        dest="output_json",
+        help="Print the output of 'status' and 'plan' as JSON",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--verify-workers",
+        help="Number of processes (threads with object storage) hashing files when verifying, 0 uses all cores",
+        type=int,
+        default=ImapDumpConfigDefaults.VERIFY_WORKERS,
+    )
+
     parser.add_argument(
         "-c",
         "--config",
@@ -150,16 +402,42 @@ def main():
         action="append",
     )
 
+    parser.add_argument(
+        "--accounts",
+        dest="accounts_file",
+        help="Supply a multi-account config file and dump all of its accounts in a single process",
+        type=str,
+    )
+
     args = parser.parse_args()
+    accounts_file = vars(args).pop("accounts_file")
+    command = vars(args).pop("command")
+    search_query = " ".join(vars(args).pop("search_query"))
+    search_limit = vars(args).pop("search_limit")
+    output_json = vars(args).pop("output_json")
+
+    if search_query and command != "search":
+        parser.error(f"unexpected arguments for '{command}': {search_query}")
+
+    if accounts_file and command != "dump":
+        parser.error(f"--accounts is only supported when dumping, not for '{command}'")
 
     config = ImapDumpConfig()
 
     if args.additional_config_files is not None:
+        import yaml
+        from dacite import Config, from_dict
+        from .config.fileconfig import ImapDumpFileConfig
+
         for config_filename in args.additional_config_files:
             with open(config_filename, "r") as f:
                 config_file = yaml.safe_load(f)
                 config_parsed = from_dict(
-                    data_class=ImapDumpFileConfig, data=config_file, config=Config(cast=[ImapEncryptionMode]),
+                    data_class=ImapDumpFileConfig,
+                    data=config_file,
+                    config=Config(
+                        cast=[ImapEncryptionMode, CatalogFormat, StorageType]
+                    ),
                 )
                 config.update_from_dict(vars(config_parsed))
 
@@ -197,8 +475,151 @@ def main():
     logger.debug(f"Using config:\n{json.dumps(asdict(config), indent=4)}")
 
     try:
-        dumper = ImapDumper(config=config)
-        dumper.dump()
+        if command == "status":
+            from .db.cache_stats import read_cache_stats
+
+            stats = read_cache_stats(config.database_file)
+
+            if output_json:
+                print(json.dumps(asdict(stats), indent=4))
+            else:
+                print_status(stats)
+        elif command == "plan":
+            from .imap.planner import plan_dump
+
+            plan = plan_dump(config)
+
+            if output_json:
+                print(
+                    json.dumps(
+                        asdict(plan) | {"new": plan.new, "removed": plan.removed},
+                        indent=4,
+                    )
+                )
+            else:
+                print_plan(plan)
+        elif command == "merge":
+            from .db.data_service import DataService
+            from .db.lease_store import LeaseStore
+            from .storage.backend import get_storage_location
+
+            if not config.coordination_file:
+                raise ValueError("Merging requires a coordination file")
+
+            lease_store = LeaseStore(config.coordination_file)
+
+            # the cached paths are relative to the dump folder, they only resolve if all nodes shared it
+            location = get_storage_location(config)
+            other_folders = {
+                node: dump_folder
+                for node, dump_folder in lease_store.get_node_dump_folders().items()
+                if dump_folder != location
+            }
+            if other_folders:
+                lease_store.close()
+                raise ValueError(
+                    f"All nodes have to dump to the dump folder of the merge '{location}', but "
+                    + ", ".join(
+                        f"'{node}' used '{folder}'"
+                        for node, folder in other_folders.items()
+                    )
+                )
+            database_files = []
+            for node, database_file in lease_store.get_node_database_files().items():
+                if database_file == os.path.abspath(config.database_file):
+                    logger.info(
+                        f"Skipping the cache of node '{node}', it's the merge target"
+                    )
+                    continue
+
+                database_files.append(database_file)
+            lease_store.close()
+
+            data_service = DataService(
+                connection_string=f"sqlite:///{config.database_file}",
+                dry_run=config.dry_run,
+            )
+            data_service.merge_caches(database_files)
+
+            if config.catalog_folder:
+                from .db.catalog import CatalogWriter
+
+                CatalogWriter(
+                    data_service,
+                    catalog_folder=config.catalog_folder,
+                    catalog_format=config.catalog_format,
+                    dry_run=config.dry_run,
+                ).update()
+
+            data_service.close_db()
+        elif command == "reassemble":
+            from .storage.reassembler import reassemble_dump
+
+            reassemble_dump(config)
+        elif command == "export-catalog":
+            from .db.catalog import CatalogWriter
+            from .db.data_service import DataService
+
+            if not config.catalog_folder:
+                raise ValueError("Exporting the catalog requires a catalog folder")
+
+            data_service = DataService(
+                connection_string=f"sqlite:///{config.database_file}",
+                dry_run=config.dry_run,
+            )
+            CatalogWriter(
+                data_service,
+                catalog_folder=config.catalog_folder,
+                catalog_format=config.catalog_format,
+                dry_run=config.dry_run,
+            ).update()
+            data_service.close_db()
+        elif command == "search":
+            from .db.fulltext_search import search_cache
+            from .storage.backend import get_storage_location
+
+            if not search_query:
+                raise ValueError("Searching requires a query")
+
+            location = get_storage_location(config)
+
+            for result in search_cache(
+                config.database_file, search_query, search_limit
+            ):
+                print(
+                    f"{result.date}  {result.folder}  {result.title}\n"
+                    f"    {os.path.join(location, result.path)}\n"
+                    f"    {result.snippet}"
+                )
+        elif command == "verify":
+            from .imap.dumper import ImapDumper
+
+            dumper = ImapDumper(config=config)
+            dumper.verify()
+        elif accounts_file:
+            import yaml
+            from dacite import from_dict
+            from .imap.scheduler import AccountScheduler
+            from .config.accounts_config import ImapDumpAccountsFileConfig
+
+            with open(accounts_file, "r") as f:
+                accounts_config = from_dict(
+                    data_class=ImapDumpAccountsFileConfig, data=yaml.safe_load(f)
+                )
+
+            scheduler = AccountScheduler(
+                accounts_config.account_configs(config),
+                max_connections=accounts_config.max_connections,
+                max_connections_per_host=accounts_config.max_connections_per_host,
+                max_write_bytes_per_second=accounts_config.max_write_bytes_per_second,
+            )
+            results = scheduler.run()
+            AccountScheduler.report(results, accounts_config.report_file)
+        else:
+            from .imap.dumper import ImapDumper
+
+            dumper = ImapDumper(config=config)
+            dumper.dump()
 
     except KeyboardInterrupt:
         logger.info("Got KeyboardInterrupt")
@@ -208,5 +629,41 @@ def main():
         logger.info("Shutting down")
 
 
+def print_status(stats):
+    last_run = stats.last_sync_run
+
+    if last_run:
+        state = "succeeded" if last_run.success else "failed"
+        print(
+            f"Last sync:  {last_run.finished} ({state}, {last_run.written} written, {last_run.removed} removed)"
+        )
+    else:
+        print(f"Last sync:  unknown, last change {stats.last_modified or 'never'}")
+
+    print(f"Cache:      {stats.database_file}")
+    print(f"Messages:   {stats.messages} ({stats.size:,} byte)")
+
+    for folder in stats.folders:
+        print(
+            f"    {folder.folder}: {folder.messages} ({folder.size:,} byte, UID <= {folder.max_uid})"
+        )
+
+
+def print_plan(plan):
+    print(f"New messages:     up to {plan.new}")
+    print(f"Removed messages: at least {plan.removed}")
+
+    for folder in plan.folders:
+        print(
+            f"    {folder.folder}: {folder.server_messages} on server, {folder.cached_messages} cached, "
+            f"up to {folder.new} new, at least {folder.removed} removed"
+        )
+
+    for folder in plan.removed_folders:
+        print(
+            f"    {folder}: cached, but not on the server or not matched by the folder regex"
+        )
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,10 @@
+from enum import StrEnum, auto
+
+
+class CatalogFormat(StrEnum):
+    PARQUET = auto()
+    ARROW = auto()
+
+    @staticmethod
+    def list():
+        return list(map(lambda c: c.value, CatalogFormat))
@@ -0,0 +1,10 @@
+from enum import StrEnum, auto
+
+
+class StorageType(StrEnum):
+    LOCAL = auto()
+    S3 = auto()
+
+    @staticmethod
+    def list():
+        return list(map(lambda c: c.value, StorageType))
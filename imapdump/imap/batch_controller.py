@@ -0,0 +1,96 @@
+import logging
+
+
+class AdaptiveBatchController:
+    """
+    Adjusts the number of messages per FETCH based on the observed round trip time and throughput.
+    Batches are sized so that a single FETCH takes about the target time, moving at most by a factor of two per step.
+    If growing a batch lowered the throughput noticeably, the previous size is restored.
+    """
+
+    batch_size: int
+    seconds: float = 0.0
+    bytes_per_second: float = 0.0
+
+    _minimum: int
+    _maximum: int
+    _target_seconds: float
+    _previous: tuple[int, float] = None
+    _logger: logging.Logger
+
+    THROUGHPUT_TOLERANCE: float = 0.75
+
+    def __init__(
+        self,
+        name: str,
+        *,
+        initial: int,
+        minimum: int,
+        maximum: int,
+        target_seconds: float,
+    ) -> None:
+        if minimum < 1 or maximum < minimum:
+            raise ValueError(
+                f"Invalid batch size bounds {minimum}..{maximum}, the minimum has to be at least 1 and not above the maximum"
+            )
+
+        self._minimum = minimum
+        self._maximum = maximum
+        self._target_seconds = target_seconds
+        self._logger = logging.getLogger(__name__).getChild(name)
+        self.batch_size = self._clamp(initial)
+
+    @property
+    def minimum(self) -> int:
+        return self._minimum
+
+    def record(self, count: int, seconds: float, byte_count: int = 0):
+        if count <= 0:
+            return
+
+        self.seconds = seconds
+        bytes_per_second = byte_count / seconds if seconds > 0 else 0.0
+
+        # partial batches (e.g. the end of a folder) don't say much about the batch size
+        if count < self.batch_size / 2:
+            return
+
+        previous = self._previous
+        self._previous = (self.batch_size, bytes_per_second)
+        self.bytes_per_second = bytes_per_second
+
+        if (
+            previous
+            and byte_count > 0
+            and previous[0] < self.batch_size
+            and bytes_per_second < previous[1] * self.THROUGHPUT_TOLERANCE
+        ):
+            self._resize(previous[0], "throughput dropped")
+            return
+
+        seconds_per_message = max(seconds, 1e-6) / count
+        ideal = self._target_seconds / seconds_per_message
+
+        # move half way towards the ideal size, but at most double or halve per step
+        new_size = (self.batch_size + ideal) / 2
+        new_size = min(max(new_size, self.batch_size / 2), self.batch_size * 2)
+        self._resize(int(new_size), f"{seconds:.2f}s round trip")
+
+    def shrink(self, failed_count: int):
+        """
+        Halves the size of a batch that the server rejected or timed out on
+        """
+        self._previous = None
+        self._resize(min(self.batch_size, failed_count) // 2, "request failed")
+
+    def _resize(self, size: int, reason: str):
+        size = self._clamp(size)
+
+        if size != self.batch_size:
+            self._logger.debug(
+                f"Changing batch size from {self.batch_size} to {size} ({reason}, {self.bytes_per_second:,.0f} byte/s)"
+            )
+            self.batch_size = size
+
+    def _clamp(self, size: int) -> int:
+        return min(max(size, self._minimum), self._maximum)
@@ -0,0 +1,45 @@
+import logging
+import re
+
+from ..config.imapdump_config import ImapDumpConfig
+from ..enums.imap_encryption_mode import ImapEncryptionMode
+from imapclient import IMAPClient
+
+
+def connect(config: ImapDumpConfig, logger: logging.Logger) -> IMAPClient:
+    """
+    Connects to the IMAP server of the given config and logs in if credentials are configured
+    """
+    if config.encryption_mode == ImapEncryptionMode.NONE:
+        client = IMAPClient(host=config.host, port=config.port, use_uid=True, ssl=False)
+    elif config.encryption_mode == ImapEncryptionMode.STARTTLS:
+        client = IMAPClient(host=config.host, port=config.port, use_uid=True, ssl=False)
+        client.starttls()
+    elif config.encryption_mode == ImapEncryptionMode.SSL:
+        client = IMAPClient(host=config.host, port=config.port, use_uid=True, ssl=True)
+
+    if config.username and config.password:
+        logger.debug(f"Logging in with credentials to IMAP server: '{config.username}'")
+        client.login(config.username, config.password)
+
+    return client
+
+
+def get_folder_names(
+    client: IMAPClient, folder_regex: str, logger: logging.Logger
+) -> list[str]:
+    # get all folders in IMAP account
+    folders = client.list_folders()
+    folder_names = []
+
+    # filter folders based on regex
+    for flags, delim, folder_name in folders:
+        logger.debug(f"{flags=}, {delim=}, {folder_name=}")
+
+        if not re.match(folder_regex, folder_name):
+            logger.info(f"Skipping ignored directory '{folder_name}'")
+            continue
+
+        folder_names.append(folder_name)
+
+    return folder_names
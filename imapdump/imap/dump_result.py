@@ -0,0 +1,35 @@
+from dataclasses import dataclass
+from datetime import datetime
+
+
+@dataclass
+class DumpResult:
+    new_or_updated: int = 0
+    written: int = 0
+    written_byte: int = 0
+    deduplicated_byte: int = 0
+    skipped: int = 0
+    removed: int = 0
+
+
+@dataclass
+class AccountResult:
+    name: str
+    host: str
+    username: str
+    started: datetime
+    duration: float = 0.0
+    success: bool = False
+    error: str = None
+    result: DumpResult = None
+
+
+@dataclass
+class VerifyResult:
+    checked: int = 0
+    ok: int = 0
+    missing: int = 0
+    truncated: int = 0
+    corrupted: int = 0
+    unhashed: int = 0
+    refetched: int = 0
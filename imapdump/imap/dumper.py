@@ -1,68 +1,123 @@
-import glob
 import logging
-import re
 import os
-import shutil
+import socket
+import threading
+import time
+from datetime import datetime, timezone
 
+from ..db.catalog import CatalogWriter
 from ..db.data_service import DataService
+from ..db.lease_store import LeaseLostError, LeaseStore, LeaseUnit
 from ..config.imapdump_config import ImapDumpConfig
-from ..enums.imap_encryption_mode import ImapEncryptionMode
 from ..models.mail import Mail
+from ..models.sync_run import SyncRun
+from ..storage.attachment_store import AttachmentStore
+from ..storage.backend import StorageBackend, create_storage_backend
+from ..storage.mime_splitter import SKELETON_SUFFIX, split_message
+from ..utils.hash_utils import bytehash
+from ..utils.mail_utils import extract_search_document
+from ..utils.rate_limiter import BandwidthLimiter
+from ..utils.str_utils import (
+    addresses_to_str,
+    decode_header_value,
+    envelope_to_msg_title,
+)
+from .batch_controller import AdaptiveBatchController
+from .client import connect, get_folder_names
+from .dump_result import DumpResult, VerifyResult
+from .search_criteria import build_search_criteria
 from imapclient import IMAPClient
+from imapclient.exceptions import IMAPClientAbortError, IMAPClientError
+from imapclient.response_types import Envelope
+
+
+class DumpCancelledError(Exception):
+    """
+    Raised inside a running dump once it was asked to stop
+    """
 
 
 class ImapDumper:
     _client: IMAPClient
     _logger: logging.Logger
     _data_service: DataService
+    _storage: StorageBackend
+    _write_limiter: BandwidthLimiter
+    _stop_event: threading.Event = None
+    _result: DumpResult
 
     _is_idle: bool = False
 
     _dump_folder: str
 
     _folder_regex: str
+    _search_criteria: list
+
+    _host: str
+    _batch_controllers: dict[str, AdaptiveBatchController]
 
     _recreate: bool
     _mirror: bool
     _dry_run: bool
 
     _db_file: str
+    _verify_workers: int
+    _fulltext_index: bool
+    _catalog_writer: CatalogWriter = None
+    _attachment_store: AttachmentStore
+    _dedup_attachments: bool
+    _attachment_min_size: int
+
+    # distributed mode
+    _lease_store: LeaseStore = None
+    _lease_unit: LeaseUnit = None
+    _node_id: str
+    _coordination_run: str
+    _uid_range_size: int
+    _lease_seconds: int
 
     CHUNKSIZE: int = 1000
 
-    def __init__(self, config: ImapDumpConfig) -> None:
-        if config.encryption_mode == ImapEncryptionMode.NONE:
-            self._client = IMAPClient(
-                host=config.host, port=config.port, use_uid=True, ssl=False
-            )
-        elif config.encryption_mode == ImapEncryptionMode.STARTTLS:
-            self._client = IMAPClient(
-                host=config.host, port=config.port, use_uid=True, ssl=False
-            )
-            self._client.starttls()
-        elif config.encryption_mode == ImapEncryptionMode.SSL:
-            self._client = IMAPClient(
-                host=config.host, port=config.port, use_uid=True, ssl=True
+    def __init__(
+        self,
+        config: ImapDumpConfig,
+        *,
+        name: str = None,
+        write_limiter: BandwidthLimiter = None,
+        stop_event: threading.Event = None,
+    ) -> None:
+        if config.coordination_file and (config.recreate or config.mirror):
+            raise ValueError(
+                "Recreate and mirror mode are not supported in distributed mode, run them against the merged cache instead"
             )
 
         self._folder_regex = config.folder_regex
+        self._search_criteria = build_search_criteria(config)
         self._recreate = config.recreate
         self._mirror = config.mirror
         self._dry_run = config.dry_run
 
         self._logger = logging.getLogger(__name__)
+        if name:
+            self._logger = self._logger.getChild(name)
+
+        self._write_limiter = write_limiter
+        self._stop_event = stop_event
+        self._result = DumpResult()
         self._db_file = config.database_file
+        self._verify_workers = config.verify_workers or os.cpu_count()
+        self._fulltext_index = config.fulltext_index
 
         self._logger.info(f"Dumping '{config.username}'@'{config.host}:{config.port}'")
-        self._dump_folder = os.path.abspath(
-            os.path.expanduser(config.dump_folder.rstrip("/"))
-        )
+        self._storage = create_storage_backend(config)
+        self._dump_folder = self._storage.location
 
-        if config.username and config.password:
-            self._logger.debug(
-                f"Logging in with credentials to IMAP server: '{config.username}'"
-            )
-            self._client.login(config.username, config.password)
+        # skeletons of messages written with deduplication can always be read, even if it's disabled now
+        self._attachment_store = AttachmentStore(self._storage)
+        self._dedup_attachments = config.dedup_attachments
+        self._attachment_min_size = config.attachment_min_size
+
+        self._client = connect(config, self._logger)
 
         if self._dry_run:
             self._logger.info(
@@ -78,19 +133,186 @@ class ImapDumper:
                 "Mirror mode activated, unknown files/folders in output folder will be removed"
             )
 
+        if self._search_criteria:
+            self._logger.info(f"Only dumping messages matching {self._search_criteria}")
+
+        if config.coordination_file:
+            # nodes started at different times have to agree on the run, so it can't be derived from the clock
+            if not config.coordination_run:
+                raise ValueError(
+                    "Distributed mode requires a run name shared by all instances (--coordination-run)"
+                )
+
+            self._lease_store = LeaseStore(config.coordination_file)
+            # stable across runs, so a node gets the units it already has in its cache again
+            self._node_id = (
+                config.node_id
+                or f"{socket.gethostname()}-{bytehash(os.path.abspath(self._db_file).encode())[:8]}"
+            )
+            self._coordination_run = config.coordination_run
+            self._uid_range_size = config.uid_range_size
+            self._lease_seconds = config.lease_seconds
+            self._logger.info(
+                f"Distributed mode activated, working on run '{self._coordination_run}' as node '{self._node_id}'"
+            )
+
         self._data_service = DataService(
             connection_string=f"sqlite:///{self._db_file}",
             recreate=self._recreate,
             dry_run=self._dry_run,
+            fulltext_index=self._fulltext_index,
         )
 
+        if config.catalog_folder and self._lease_store:
+            self._logger.info(
+                "The catalog isn't updated in distributed mode, it's written when merging the caches instead"
+            )
+        elif config.catalog_folder:
+            self._catalog_writer = CatalogWriter(
+                self._data_service,
+                catalog_folder=config.catalog_folder,
+                catalog_format=config.catalog_format,
+                dry_run=self._dry_run,
+            )
+
+        # start with the batch sizes tuned during the last run against this host
+        self._host = config.host
+        self._batch_controllers = {}
+        # the size checks return far less data per message than the envelope fetches, so they are tuned apart
+        for phase in ["sizes", "cache", "writer"]:
+            tuning = self._data_service.get_host_tuning(self._host, phase)
+            self._batch_controllers[phase] = AdaptiveBatchController(
+                phase,
+                initial=tuning.batch_size if tuning else self.CHUNKSIZE,
+                minimum=config.batch_size_min,
+                maximum=config.batch_size_max,
+                target_seconds=config.batch_target_seconds,
+            )
+            self._logger.debug(
+                f"Starting with a batch size of {self._batch_controllers[phase].batch_size} for the {phase} phase"
+            )
+
         self._set_idle(True)
         self._is_idle = True
 
-    def dump(self):
-        empty_folders = self._write_all_messages_to_db()
-        self._dump_to_folder(empty_folders)
-        self._data_service.close_db()
+    def dump(self) -> DumpResult:
+        started = self._utcnow()
+        success = False
+
+        try:
+            if self._lease_store:
+                self._dump_leased_units()
+            else:
+                empty_folders = self._write_all_messages_to_db()
+                self._dump_to_folder(empty_folders)
+
+                if self._catalog_writer:
+                    self._catalog_writer.update()
+
+            success = True
+        finally:
+            self._save_batch_sizes()
+            self._save_sync_run(started, success)
+            self._data_service.close_db()
+            if self._lease_store:
+                self._lease_store.close()
+            self._storage.close()
+            self._logout()
+
+        return self._result
+
+    def verify(self) -> VerifyResult:
+        """
+        Rehashes all dumped messages in parallel and compares them against the hashes recorded while writing.
+        Missing, truncated and corrupted files are fetched from the server again.
+        """
+        logger = self._logger.getChild("verify")
+        result = VerifyResult()
+
+        try:
+            mails = self._data_service.get_all_mails()
+            filenames = [mail.path for mail in mails]
+
+            logger.info(
+                f"Verifying {len(mails)} message(s) in '{self._dump_folder}' using {self._verify_workers} worker(s)"
+            )
+
+            broken_mails = []
+
+            with self._storage.parallel_executor(
+                max_workers=self._verify_workers
+            ) as executor:
+                sized_hashes = executor.map(
+                    self._attachment_store.sized_message_hash, filenames, chunksize=256
+                )
+
+                for mail, filename, sized_hash in zip(mails, filenames, sized_hashes):
+                    result.checked += 1
+
+                    if sized_hash is None:
+                        logger.info(f"Missing: '{filename}'")
+                        result.missing += 1
+                        broken_mails.append(mail)
+                        continue
+
+                    size, content_hash = sized_hash
+
+                    if mail.content_hash is None and size > 0:
+                        # dumped by an older version, take the file as it is
+                        mail.content_hash = content_hash
+                        result.unhashed += 1
+                    elif mail.content_hash == content_hash:
+                        result.ok += 1
+                    elif size < mail.size:
+                        logger.info(
+                            f"Truncated: '{filename}' ({size:,} of {mail.size:,} byte)"
+                        )
+                        result.truncated += 1
+                        broken_mails.append(mail)
+                    else:
+                        logger.info(f"Corrupted: '{filename}'")
+                        result.corrupted += 1
+                        broken_mails.append(mail)
+
+                    if result.checked % 10000 == 0:
+                        logger.info(
+                            f"Verification progress: {(result.checked / len(mails)) * 100:.2f}%"
+                        )
+
+            self._data_service.commit()
+
+            logger.info(
+                f"Verified {result.checked} message(s): {result.ok} ok, {result.missing} missing, "
+                f"{result.truncated} truncated, {result.corrupted} corrupted, {result.unhashed} without a recorded hash"
+            )
+
+            if len(broken_mails) > 0 and not self._dry_run:
+                self._remove_corrupted_attachments(broken_mails, logger)
+
+            if len(broken_mails) > 0:
+                folder_uid_map = {}
+                for mail in broken_mails:
+                    folder_uid_map.setdefault(mail.folder, {})[str(mail.uid)] = mail
+
+                    if not self._dry_run:
+                        self._storage.make_folder(mail.folder)
+
+                logger.info(f"Fetching {len(broken_mails)} message(s) again")
+                self._set_idle(False)
+                result.refetched, _ = self._write_messages(folder_uid_map, logger)
+                self._set_idle(True)
+
+                if result.refetched < len(broken_mails):
+                    logger.warning(
+                        f"{len(broken_mails) - result.refetched} message(s) are not available on the server anymore"
+                    )
+        finally:
+            self._save_batch_sizes()
+            self._data_service.close_db()
+            self._storage.close()
+            self._logout()
+
+        return result
 
     def _write_all_messages_to_db(self) -> dict:
         logger = self._logger.getChild("cache")
@@ -98,121 +320,157 @@ class ImapDumper:
         # stop idling
         self._set_idle(False)
 
-        # get all folders in IMAP account
-        folders = self._client.list_folders()
-        folder_names = []
+        folder_names = get_folder_names(self._client, self._folder_regex, logger)
         empty_folders = []
 
         seen_mails = []
-
-        # filter folders based on regex
-        for flags, delim, folder_name in folders:
-            logger.debug(f"{flags=}, {delim=}, {folder_name=}")
-
-            if not re.match(self._folder_regex, folder_name):
-                logger.info(f"Skipping ignored directory '{folder_name}'")
-                continue
-
-            folder_names.append(folder_name)
-
         messages = []
 
         # iterate over the remaining folders
         for folder_name in folder_names:
             # select folder to be examined
-            self._client.select_folder(folder_name, readonly=True)
+            folder_info = self._client.select_folder(folder_name, readonly=True)
 
-            message_ids = self._client.search()
+            message_ids = self._client.search(self._search_criteria or "ALL")
 
-            if len(message_ids) <= 0:
+            if folder_info.get(b"EXISTS", len(message_ids)) <= 0:
                 logger.info(f"Skipping empty directory '{folder_name}'")
                 empty_folders.append(folder_name)
+            elif len(message_ids) <= 0:
+                logger.info(
+                    f"Skipping directory '{folder_name}', no messages match the search criteria"
+                )
 
-            chunks, remainder = divmod(len(message_ids), self.CHUNKSIZE)
+            if self._mirror and self._search_criteria:
+                # messages outside of the search window still exist on the server, so they have to be kept
+                matching_ids = set(message_ids)
+                seen_mails.extend(
+                    Mail.generate_id(folder_name=folder_name, message_id=message_id)
+                    for message_id in self._client.search()
+                    if message_id not in matching_ids
+                )
 
             logger.info(
                 f"Processing {len(message_ids)} message(s) in directory '{folder_name}'"
             )
 
-            if remainder != 0:
-                chunks += 1
+            folder_messages, folder_seen_mails = self._cache_messages(
+                folder_name, message_ids, logger
+            )
+            messages.extend(folder_messages)
+            seen_mails.extend(folder_seen_mails)
 
-            for chunk in range(chunks):
-                start = chunk * self.CHUNKSIZE
-                end = min((chunk + 1) * self.CHUNKSIZE, len(message_ids))
+        self._data_service.save_all_and_commit(messages)
 
-                ids = message_ids[start:end]
+        if self._mirror:
+            self._data_service.remove_diff(seen_mails)
 
-                percentage = (end / len(message_ids)) * 100
+        # back to idling
+        self._set_idle(True)
 
-                new_or_updated_messages = []
+        self._result.new_or_updated = len(messages)
 
-                if self._recreate:
-                    # don't check against database if force dumping
-                    self._data_service.remove_all_mails()  # clean the cache
-                    new_or_updated_messages = ids
-                else:
-                    # don't retrieve entire message at first, only the size. Then compare to files already dumped and retrieve the full message as necessary.
-                    for message_id, data in self._client.fetch(
-                        messages=ids, data=["RFC822.SIZE"]
-                    ).items():
-                        mail_entity = Mail()
-                        id = Mail.generate_id(
-                            folder_name=folder_name, message_id=message_id
-                        )
-                        size = data.get(b"RFC822.SIZE")
+        logger.info("Done updating cache")
+        logger.info(f"Found {len(messages)} new or updated message(s) to dump")
 
-                        create_or_update = (
-                            self._data_service.mail_has_to_be_created_or_updated(
-                                id, size
-                            )
-                        )
+        return empty_folders
 
-                        if self._mirror:
-                            seen_mails.append(id)
+    def _cache_messages(
+        self, folder_name: str, message_ids: list, logger: logging.Logger
+    ) -> tuple[list[Mail], list[str]]:
+        """
+        Fetches the metadata of all new or changed messages out of the given ones in the currently selected folder.
+        Returns the mail entities to be saved and the ids of all messages that have been seen.
+        """
+        messages = []
+        seen_mails = []
 
-                        if not create_or_update:
-                            continue
+        sizes_controller = self._batch_controllers["sizes"]
+        controller = self._batch_controllers["cache"]
 
-                        new_or_updated_messages.append(message_id)
+        for ids, percentage in self._batches(message_ids, sizes_controller):
+            new_or_updated_messages = []
+            cached_mails = {}
 
-                for message_id, data in self._client.fetch(
-                    messages=new_or_updated_messages,
-                    data=[
-                        "RFC822.SIZE",
-                        "INTERNALDATE",
-                        "BODY[HEADER.FIELDS (SUBJECT)]",
-                    ],
-                ).items():
-                    id = Mail.generate_id(
-                        folder_name=folder_name, message_id=message_id
+            if self._recreate:
+                # don't check against database if force dumping
+                self._data_service.remove_all_mails()  # clean the cache
+                new_or_updated_messages = ids
+            else:
+                # don't retrieve entire message at first, only the size. Then compare to files already dumped and retrieve the full message as necessary.
+                sizes = {
+                    Mail.generate_id(folder_name=folder_name, message_id=message_id): (
+                        message_id,
+                        data.get(b"RFC822.SIZE"),
+                    )
+                    for message_id, data in self._fetch(
+                        sizes_controller, ids, ["RFC822.SIZE"]
+                    ).items()
+                }
+
+                # look up the whole batch at once instead of one query per message
+                cached_mails = {
+                    mail.id: mail
+                    for mail in self._data_service.get_mails_by_ids(list(sizes.keys()))
+                }
+
+                for id, (message_id, size) in sizes.items():
+                    if self._mirror:
+                        seen_mails.append(id)
+
+                    mail = cached_mails.get(id)
+                    if mail is not None and mail.size == size:
+                        continue
+
+                    new_or_updated_messages.append(message_id)
+
+            for message_id, data in self._fetch(
+                controller,
+                new_or_updated_messages,
+                [
+                    "RFC822.SIZE",
+                    "INTERNALDATE",
+                    "ENVELOPE",
+                ],
+            ).items():
+                id = Mail.generate_id(folder_name=folder_name, message_id=message_id)
+                mail_entity = cached_mails.get(id)
+
+                if mail_entity is None:
+                    mail_entity = Mail()
+                    mail_entity.id = id
+
+                mail_entity.size = data.get(b"RFC822.SIZE")
+                mail_entity.folder = folder_name
+                mail_entity.uid = message_id
+                mail_entity.date = data.get(b"INTERNALDATE")
+
+                envelope: Envelope = data.get(b"ENVELOPE")
+                mail_entity.title = ""
+
+                if envelope:
+                    mail_entity.title = decode_header_value(envelope.subject)
+                    mail_entity.sender = addresses_to_str(
+                        envelope.from_ or envelope.sender
+                    )
+                    mail_entity.recipients = addresses_to_str(
+                        (envelope.to or ()) + (envelope.cc or ()) + (envelope.bcc or ())
                     )
-                    mail_entity = self._data_service.get_or_create_mail_by_id(id)
-                    mail_entity.size = data.get(b"RFC822.SIZE")
-                    mail_entity.title = data.get(
-                        b"BODY[HEADER.FIELDS (SUBJECT)]"
-                    ).decode(errors="ignore")[9:]
-
-                    mail_entity.folder = folder_name
-                    mail_entity.uid = message_id
-                    mail_entity.date = data.get(b"INTERNALDATE")
-
-                    messages.append(mail_entity)
-
-                logger.info(f"'{folder_name}' progress: {percentage:.2f}%")
-
-        self._data_service.save_all_and_commit(messages)
 
-        if self._mirror:
-            self._data_service.remove_diff(seen_mails)
+                # keep the name of an already dumped file if the message only changed
+                if not mail_entity.path:
+                    mail_entity.path = Mail.generate_path(
+                        folder_name=folder_name,
+                        id=id,
+                        title=envelope_to_msg_title(envelope) if envelope else "",
+                    )
 
-        # back to idling
-        self._set_idle(True)
+                messages.append(mail_entity)
 
-        logger.info("Done updating cache")
-        logger.info(f"Found {len(messages)} new or updated message(s) to dump")
+            self._renew_lease()
+            logger.info(f"'{folder_name}' progress: {percentage:.2f}%")
 
-        return empty_folders
+        return messages, seen_mails
 
     def _dump_to_folder(self, empty_folders: list[str]):
         logger = self._logger.getChild("writer")
@@ -222,70 +480,40 @@ class ImapDumper:
 
         logger.info(f"Dumping {len(all_mails)} message(s) to '{self._dump_folder}'")
 
-        if self._recreate and os.path.isdir(self._dump_folder) and not self._dry_run:
+        if self._recreate and not self._dry_run:
             logger.info(f"Deleting '{self._dump_folder}'")
-            shutil.rmtree(self._dump_folder)
+            self._storage.clear()
 
-        if not self._dry_run:
-            os.makedirs(self._dump_folder, exist_ok=True)
-
-        all_unknown_files = glob.glob(
-            pathname="**", root_dir=self._dump_folder, recursive=True
-        )
+        existing_paths = self._storage.list_paths()
 
         for empty_folder in empty_folders:
             logger.info(f"Dumping empty folder '{empty_folder}'")
             if not self._dry_run:
-                os.makedirs(
-                    os.path.join(self._dump_folder, empty_folder), exist_ok=True
-                )
-            try:
-                all_unknown_files.remove(empty_folder)
-            except ValueError:
-                pass
-
-        written = 0
-        written_byte = 0
-        to_write = 0
-        skipped = 0
-
-        folder_uid_map = {}
+                self._storage.make_folder(empty_folder)
 
+        known_paths = set(empty_folders)
         for mail in all_mails:
-            fs_mail_folder = os.path.join(self._dump_folder, mail.folder)
-            if not os.path.isdir(fs_mail_folder) and not self._dry_run:
-                os.makedirs(fs_mail_folder, exist_ok=False)
-
-            filename = mail.filename
-
-            try:
-                all_unknown_files.remove(os.path.join(mail.folder, filename))
-            except ValueError:
-                pass
-
-            if mail.folder in all_unknown_files:
-                all_unknown_files.remove(mail.folder)
-
-            full_filename = os.path.join(fs_mail_folder, filename)
-
-            # skip file write if not force dumping and the file already exists
-            if os.path.exists(full_filename) and not self._recreate:
-                skipped += 1
-                continue
+            known_paths.add(mail.path)
+            known_paths.add(mail.path + SKELETON_SUFFIX)
+            known_paths.add(mail.folder)
 
-            if mail.folder not in folder_uid_map.keys():
-                folder_uid_map[mail.folder] = {}
+        # parents of nested folders (e.g. 'Archive' of 'Archive/2024') aren't unknown either
+        for known_path in list(known_paths):
+            parent = os.path.dirname(known_path)
+            while parent and parent not in known_paths:
+                known_paths.add(parent)
+                parent = os.path.dirname(parent)
 
-            folder_uid_map[mail.folder][str(mail.uid)] = (full_filename, mail.date)
-            to_write += 1
+        folder_uid_map, skipped = self._get_mails_to_write(all_mails, existing_paths)
 
         if skipped != len(all_mails):
             self._set_idle(False)
 
         unknown_emls = []
         unknown_files = []
-        for unknown_file in all_unknown_files:
-            if unknown_file.endswith(".eml"):
+        for unknown_file in sorted(existing_paths - known_paths):
+            # skeletons are dumped messages as well
+            if unknown_file.endswith((".eml", f".eml{SKELETON_SUFFIX}")):
                 unknown_emls.append(unknown_file)
             else:
                 unknown_files.append(unknown_file)
@@ -298,8 +526,9 @@ class ImapDumper:
             if self._mirror:
                 for unknown_eml in unknown_emls:
                     logger.info(f"Removing unknown file '{unknown_eml}'")
+                    self._result.removed += 1
                     if not self._dry_run:
-                        os.unlink(os.path.join(self._dump_folder, unknown_eml))
+                        self._storage.remove(unknown_eml)
 
         if len(unknown_files) > 0:
             unknown_files_string = "\n".join(
@@ -311,73 +540,478 @@ class ImapDumper:
 
             if self._mirror:
                 for unknown_file in unknown_files:
-                    if os.path.isfile(unknown_file):
+                    if self._storage.size(unknown_file) is not None:
                         logger.info(f"Removing unknown file '{unknown_file}'")
                         if not self._dry_run:
-                            os.unlink(os.path.join(self._dump_folder, unknown_file))
+                            self._storage.remove(unknown_file)
                     else:
                         logger.info(f"Removing unknown folder '{unknown_file}'")
                         if not self._dry_run:
-                            shutil.rmtree(
-                                os.path.join(self._dump_folder, unknown_file),
-                                ignore_errors=True,
-                            )
+                            self._storage.remove_tree(unknown_file)
 
-        for folder_name, mails_in_folder in folder_uid_map.items():
-            self._client.select_folder(folder_name, readonly=True)
+                if not self._dry_run:
+                    self._storage.flush()
 
-            message_ids = list(mails_in_folder.keys())
+        written, written_byte = self._write_messages(folder_uid_map, logger)
+
+        if written > 0:
+            self._set_idle(True)
+
+        if self._data_service.has_fulltext_index:
+            self._index_dumped_mails(logger)
+
+        if not self._dry_run:
+            self._remove_orphaned_attachments(logger)
 
-            chunks, remainder = divmod(len(mails_in_folder.keys()), self.CHUNKSIZE)
+        self._result.written = written
+        self._result.written_byte = written_byte
+        self._result.skipped = skipped
 
+        logger.info("Done writing to filesystem")
+        logger.info(
+            f"Dumped {written} message(s) {'(SIMULATED)' if self._dry_run else ''} ({written_byte:,} byte) ({skipped} already dumped before)"
+        )
+
+        if self._result.deduplicated_byte > 0:
             logger.info(
-                f"Writing {len(message_ids)} message(s) from IMAP directory '{folder_name}'"
+                f"Skipped writing {self._result.deduplicated_byte:,} byte of attachments that were already stored"
             )
 
-            if remainder != 0:
-                chunks += 1
+    def _get_mails_to_write(
+        self, mails: list[Mail], existing_paths: set[str] = None
+    ) -> tuple[dict, int]:
+        """
+        Groups all given mails that have not been dumped yet by folder.
+        If a listing of the dump folder is given, files are looked up in it instead of checking each of them on disk.
+        Returns the mapping of folder -> uid -> mail and the number of skipped mails.
+        """
+        skipped = 0
+        folder_uid_map = {}
+        created_folders = set()
+
+        for mail in mails:
+            if mail.folder not in created_folders and not self._dry_run:
+                self._storage.make_folder(mail.folder)
+                created_folders.add(mail.folder)
+
+            if existing_paths is not None:
+                exists = (
+                    mail.path in existing_paths
+                    or mail.path + SKELETON_SUFFIX in existing_paths
+                )
+            else:
+                exists = (
+                    self._storage.size(mail.path) is not None
+                    or self._storage.size(mail.path + SKELETON_SUFFIX) is not None
+                )
+
+            # skip file write if not force dumping and the file already exists
+            if exists and not self._recreate:
+                skipped += 1
+                continue
+
+            if mail.folder not in folder_uid_map.keys():
+                folder_uid_map[mail.folder] = {}
+
+            folder_uid_map[mail.folder][str(mail.uid)] = mail
 
-            for chunk in range(chunks):
-                start = chunk * self.CHUNKSIZE
-                end = min((chunk + 1) * self.CHUNKSIZE, len(message_ids))
+        return folder_uid_map, skipped
 
-                ids = message_ids[start:end]
+    def _write_messages(
+        self, folder_uid_map: dict, logger: logging.Logger
+    ) -> tuple[int, int]:
+        written = 0
+        written_byte = 0
+
+        controller = self._batch_controllers["writer"]
+
+        for folder_name, mails_in_folder in folder_uid_map.items():
+            self._client.select_folder(folder_name, readonly=True)
+
+            message_ids = list(mails_in_folder.keys())
 
-                percentage = (end / len(message_ids)) * 100
+            logger.info(
+                f"Writing {len(message_ids)} message(s) from IMAP directory '{folder_name}'"
+            )
 
-                for message_id, data in self._client.fetch(
-                    messages=ids, data=["RFC822"]
+            for ids, percentage in self._batches(message_ids, controller):
+                for message_id, data in self._fetch(
+                    controller, ids, ["RFC822"]
                 ).items():
                     rfc822 = data.get(b"RFC822")
-                    # bruh this is so terrible
-                    filename = mails_in_folder[str(message_id)][0]
-                    mail_date = mails_in_folder[str(message_id)][1]
+                    mail = mails_in_folder[str(message_id)]
+                    mail_date = mail.date
 
                     logger.debug(
-                        f"Writing message {message_id} RFC822 data ({len(rfc822)} chars) to '{filename}'"
+                        f"Writing message {message_id} RFC822 data ({len(rfc822)} chars) to '{mail.path}'"
                     )
 
                     if not self._dry_run:
-                        with open(filename, mode="wb") as f:
-                            written_byte += f.write(rfc822)
+                        written_path, content, attachment_byte = self._split_message(
+                            mail, mail.path, rfc822
+                        )
+                        written_byte += attachment_byte
 
-                    written += 1
+                        if self._write_limiter:
+                            self._write_limiter.consume(len(content))
 
-                    # set modification time to mail timestamp
-                    if not self._dry_run:
-                        os.utime(
-                            filename, (mail_date.timestamp(), mail_date.timestamp())
+                        # set modification time to mail timestamp
+                        written_byte += self._storage.write(
+                            written_path, content, mtime=mail_date.timestamp()
                         )
 
+                    mail.content_hash = bytehash(rfc822)
+                    written += 1
+
+                    if self._data_service.has_fulltext_index:
+                        self._index_mail(mail, rfc822, logger)
+
+                # persist the content hashes of the written messages once they're stored
+                if not self._dry_run:
+                    self._storage.flush()
+                self._data_service.commit()
+
+                self._renew_lease()
                 logger.info(f"Writing '{folder_name}' progress: {percentage:.2f}%")
 
-        if written > 0:
-            self._set_idle(True)
+        return written, written_byte
+
+    def _split_message(
+        self, mail: Mail, path: str, rfc822: bytes
+    ) -> tuple[str, bytes, int]:
+        """
+        Moves large attachments of a message into the attachment store if deduplication is enabled.
+        Returns the file to write and its content, either the skeleton or the message itself,
+        along with the number of bytes written to the attachment store.
+        """
+        skeleton, parts = None, {}
+        attachment_byte = 0
+
+        if self._dedup_attachments:
+            skeleton, parts = split_message(rfc822, self._attachment_min_size)
+
+        for digest, data in parts.items():
+            if self._write_limiter:
+                self._write_limiter.consume(len(data))
+
+            if self._attachment_store.put(digest, data):
+                attachment_byte += len(data)
+            else:
+                self._result.deduplicated_byte += len(data)
+
+        # don't leave a stale copy in the other format behind
+        stale_path = path if skeleton else path + SKELETON_SUFFIX
+        stale_skeleton = False
+        if self._storage.size(stale_path) is not None:
+            self._storage.remove(stale_path)
+            stale_skeleton = not skeleton
+
+        if self._dedup_attachments or stale_skeleton:
+            self._data_service.save_mail_attachments(
+                mail.id, {digest: len(data) for digest, data in parts.items()}
+            )
+
+        if skeleton:
+            return path + SKELETON_SUFFIX, skeleton, attachment_byte
+
+        return path, rfc822, attachment_byte
+
+    def _remove_orphaned_attachments(self, logger: logging.Logger):
+        orphans = self._data_service.remove_orphaned_attachments()
+
+        if len(orphans) <= 0:
+            return
+
+        for orphan in orphans:
+            self._attachment_store.remove(orphan.digest)
 
-        logger.info("Done writing to filesystem")
         logger.info(
-            f"Dumped {written} message(s) {'(SIMULATED)' if self._dry_run else ''} ({written_byte:,} byte) ({skipped} already dumped before)"
+            f"Removed {len(orphans)} attachment(s) ({sum(o.size for o in orphans):,} byte) that no message references anymore"
+        )
+
+    def _remove_corrupted_attachments(self, mails: list[Mail], logger: logging.Logger):
+        """
+        Removes corrupted attachments of the given messages from the store, so they are written again when the messages are fetched
+        """
+        for digest in self._data_service.get_attachment_digests(
+            [mail.id for mail in mails]
+        ):
+            if not self._attachment_store.is_intact(digest):
+                logger.info(f"Corrupted attachment: '{digest}'")
+                self._attachment_store.remove(digest)
+
+    def _index_mail(self, mail: Mail, rfc822: bytes, logger: logging.Logger):
+        try:
+            self._data_service.index_mail(mail.id, extract_search_document(rfc822))
+        except Exception:
+            logger.warning(
+                f"Failed to add message {mail.uid} in '{mail.folder}' to the full text index",
+                exc_info=True,
+            )
+
+    def _index_dumped_mails(self, logger: logging.Logger):
+        """
+        Adds messages that were dumped before the full text index was enabled to the index, reading them from the dump folder
+        """
+        unindexed_mails = self._data_service.get_unindexed_mails()
+
+        if len(unindexed_mails) <= 0:
+            return
+
+        logger.info(
+            f"Adding {len(unindexed_mails)} already dumped message(s) to the full text index"
+        )
+
+        for i, mail in enumerate(unindexed_mails, start=1):
+            try:
+                rfc822 = self._attachment_store.read_message(mail.path)
+            except (OSError, ValueError):
+                logger.warning(f"Failed to read '{mail.path}'", exc_info=True)
+                continue
+
+            if rfc822 is None:
+                continue
+
+            self._index_mail(mail, rfc822, logger)
+
+            if i % 10000 == 0:
+                self._data_service.commit()
+                logger.info(
+                    f"Indexing progress: {(i / len(unindexed_mails)) * 100:.2f}%"
+                )
+
+        self._data_service.commit()
+
+    def _batches(self, message_ids: list, controller: AdaptiveBatchController):
+        """
+        Splits the given message ids into batches sized by the controller.
+        The batch size is read again for every batch, so changes apply right away.
+        Yields every batch along with the progress in percent.
+        """
+        start = 0
+        while start < len(message_ids):
+            # checked between batches, so a stopped dump only finishes the request that's in flight
+            if self._stop_event and self._stop_event.is_set():
+                raise DumpCancelledError("Dump was stopped")
+
+            end = min(start + controller.batch_size, len(message_ids))
+            yield message_ids[start:end], (end / len(message_ids)) * 100
+            start = end
+
+    def _fetch(
+        self, controller: AdaptiveBatchController, messages: list, data: list
+    ) -> dict:
+        """
+        Fetches the given messages and reports the round trip time and the amount of data to the controller.
+        If the server rejects the request, it's retried in smaller batches until the minimum batch size is reached.
+        Aborted connections are not retried.
+        """
+        if len(messages) <= 0:
+            return {}
+
+        if len(messages) > controller.batch_size:
+            response = {}
+            for ids, _ in self._batches(messages, controller):
+                response.update(self._fetch(controller, ids, data))
+
+            return response
+
+        start = time.monotonic()
+        try:
+            response = self._client.fetch(messages=messages, data=data)
+        except IMAPClientAbortError:
+            # the connection is gone, retrying on it can't succeed
+            raise
+        except IMAPClientError:
+            if len(messages) <= controller.minimum:
+                raise
+
+            controller.shrink(len(messages))
+            self._logger.warning(
+                f"FETCH of {len(messages)} message(s) failed, retrying in batches of {controller.batch_size}",
+                exc_info=self._logger.isEnabledFor(logging.DEBUG),
+            )
+
+            return self._fetch(controller, messages, data)
+        except TimeoutError:
+            # the connection is unusable after a timeout, but the next run should start out smaller
+            controller.shrink(len(messages))
+            raise
+
+        byte_count = sum(
+            len(value)
+            for message_data in response.values()
+            for value in message_data.values()
+            if isinstance(value, bytes)
         )
+        controller.record(len(messages), time.monotonic() - start, byte_count)
+
+        return response
+
+    def _save_batch_sizes(self):
+        try:
+            for phase, controller in self._batch_controllers.items():
+                self._data_service.save_host_tuning(
+                    self._host,
+                    phase,
+                    controller.batch_size,
+                    controller.bytes_per_second,
+                )
+        except Exception:
+            self._logger.warning("Failed to save tuned batch sizes", exc_info=True)
+
+    def _save_sync_run(self, started: datetime, success: bool):
+        try:
+            sync_run = SyncRun()
+            sync_run.started = started
+            sync_run.finished = self._utcnow()
+            sync_run.success = success
+            sync_run.new_or_updated = self._result.new_or_updated
+            sync_run.written = self._result.written
+            sync_run.written_byte = self._result.written_byte
+            sync_run.skipped = self._result.skipped
+            sync_run.removed = self._result.removed
+            self._data_service.save_and_commit(sync_run)
+        except Exception:
+            self._logger.warning("Failed to record the run in the cache", exc_info=True)
+
+    @staticmethod
+    def _utcnow() -> datetime:
+        # stored without a timezone, like the timestamps SQLite generates
+        return datetime.now(timezone.utc).replace(tzinfo=None)
+
+    def _dump_leased_units(self):
+        """
+        Distributed mode: splits the account into units of work shared with the other nodes through the coordination store,
+        then caches and dumps one leased unit after another until none are left.
+        """
+        logger = self._logger.getChild("node")
+        self._set_idle(False)
+
+        units = []
+        for folder_name in get_folder_names(self._client, self._folder_regex, logger):
+            if self._uid_range_size <= 0:
+                units.append(LeaseUnit(self._coordination_run, folder_name, 1, None))
+                continue
+
+            uid_next = self._client.folder_status(folder_name, [b"UIDNEXT"])[b"UIDNEXT"]
+
+            # the last range is left open so messages arriving during the run are picked up as well
+            range_starts = list(range(1, max(uid_next, 2), self._uid_range_size))
+            for i, uid_start in enumerate(range_starts):
+                uid_end = range_starts[i + 1] - 1 if i + 1 < len(range_starts) else None
+                units.append(
+                    LeaseUnit(self._coordination_run, folder_name, uid_start, uid_end)
+                )
+
+        for unit in self._lease_units(units):
+            logger.info(f"Leased {unit}")
+
+            try:
+                self._dump_unit(unit, logger)
+            except LeaseLostError:
+                # the other node dumps the unit again, don't mark it as done
+                logger.warning(f"Stopped working on {unit}")
+                self._lease_unit = None
+
+        self._set_idle(True)
+
+        logger.info(
+            f"No units left, dumped {self._result.written} message(s) {'(SIMULATED)' if self._dry_run else ''} "
+            f"({self._result.written_byte:,} byte) ({self._result.skipped} already dumped before)"
+        )
+
+    def _dump_unit(self, unit: LeaseUnit, logger: logging.Logger):
+        folder_info = self._client.select_folder(unit.folder, readonly=True)
+
+        # 'n:*' always matches the last message of the folder, even if its UID is below n
+        message_ids = [
+            message_id
+            for message_id in self._client.search(
+                ["UID", f"{unit.uid_start}:{unit.uid_end or '*'}"]
+                + self._search_criteria
+            )
+            if unit.uid_start <= message_id
+            and (unit.uid_end is None or message_id <= unit.uid_end)
+        ]
+
+        if (
+            folder_info.get(b"EXISTS", len(message_ids)) <= 0
+            and unit.uid_start == 1
+            and unit.uid_end is None
+        ):
+            logger.info(f"Dumping empty folder '{unit.folder}'")
+            if not self._dry_run:
+                self._storage.make_folder(unit.folder)
+
+        messages, _ = self._cache_messages(unit.folder, message_ids, logger)
+        self._data_service.save_all_and_commit(messages)
+        self._result.new_or_updated += len(messages)
+
+        mails = self._data_service.get_mails_by_ids(
+            [
+                Mail.generate_id(folder_name=unit.folder, message_id=message_id)
+                for message_id in message_ids
+            ]
+        )
+        folder_uid_map, skipped = self._get_mails_to_write(mails)
+        written, written_byte = self._write_messages(folder_uid_map, logger)
+
+        self._result.written += written
+        self._result.written_byte += written_byte
+        self._result.skipped += skipped
+
+        logger.info(
+            f"Finished {unit}: dumped {written} message(s) ({written_byte:,} byte)"
+        )
+
+    def _lease_units(self, units: list[LeaseUnit]):
+        """
+        Yields one leased unit after another and marks each as done once the caller is finished with it.
+        A dry run doesn't touch the coordination store and simply yields all units of this node's view.
+        """
+        if self._dry_run:
+            yield from units
+            return
+
+        self._lease_store.register_node(
+            self._node_id,
+            os.path.abspath(self._db_file),
+            self._dump_folder,
+            self._lease_seconds,
+        )
+        self._lease_store.register_units(units)
+
+        try:
+            while unit := self._lease_store.claim(
+                self._coordination_run, self._node_id, self._lease_seconds
+            ):
+                self._lease_unit = unit
+                yield unit
+
+                # reset by the caller if the lease was lost
+                if self._lease_unit is None:
+                    continue
+
+                self._lease_unit = None
+                self._lease_store.complete(unit, self._node_id)
+                done, total = self._lease_store.get_progress(self._coordination_run)
+                self._logger.info(f"{done}/{total} unit(s) of the run done")
+        finally:
+            self._lease_store.finish_node(self._node_id)
+
+    def _renew_lease(self):
+        if self._lease_unit and not self._lease_store.renew(
+            self._lease_unit, self._node_id, self._lease_seconds
+        ):
+            raise LeaseLostError(f"Lost lease on {self._lease_unit}")
+
+    def _logout(self):
+        try:
+            self._set_idle(False)
+            self._client.logout()
+        except Exception:
+            self._logger.debug("Failed to log out cleanly", exc_info=True)
 
     def _set_idle(self, idle: bool):
         if idle and not self._is_idle:
@@ -0,0 +1,79 @@
+import logging
+import os
+from dataclasses import dataclass, field
+
+from .client import connect, get_folder_names
+from ..config.imapdump_config import ImapDumpConfig
+from ..db.cache_stats import read_cache_stats
+
+
+@dataclass
+class FolderPlan:
+    folder: str
+    server_messages: int
+    cached_messages: int
+    new: int
+    removed: int
+
+
+@dataclass
+class DumpPlan:
+    folders: list[FolderPlan] = field(default_factory=list)
+    removed_folders: list[str] = field(default_factory=list)
+
+    @property
+    def new(self) -> int:
+        return sum(f.new for f in self.folders)
+
+    @property
+    def removed(self) -> int:
+        return sum(f.removed for f in self.folders)
+
+
+def plan_dump(config: ImapDumpConfig) -> DumpPlan:
+    """
+    Estimates what the next dump would do from the cached state and a single STATUS call per folder.
+    New messages are an upper bound (UIDs may have been skipped), removed messages a lower bound
+    (the same number of messages may have been added and removed). Search filters are not applied.
+    """
+    logger = logging.getLogger(__name__)
+
+    cached = {}
+    if os.path.isfile(config.database_file):
+        cached = {
+            folder.folder: folder
+            for folder in read_cache_stats(config.database_file).folders
+        }
+
+    plan = DumpPlan()
+    client = connect(config, logger)
+
+    try:
+        for folder in get_folder_names(client, config.folder_regex, logger):
+            status = client.folder_status(folder, [b"MESSAGES", b"UIDNEXT"])
+            messages = status[b"MESSAGES"]
+            uidnext = status[b"UIDNEXT"]
+
+            cached_folder = cached.pop(folder, None)
+            cached_messages = cached_folder.messages if cached_folder else 0
+            max_uid = (cached_folder.max_uid or 0) if cached_folder else 0
+
+            plan.folders.append(
+                FolderPlan(
+                    folder=folder,
+                    server_messages=messages,
+                    cached_messages=cached_messages,
+                    new=max(0, min(messages, uidnext - 1 - max_uid)),
+                    removed=max(0, cached_messages - messages),
+                )
+            )
+    finally:
+        try:
+            client.logout()
+        except Exception:
+            logger.debug("Failed to log out cleanly", exc_info=True)
+
+    # folders that are cached but not on the server (anymore) or not matched by the regex
+    plan.removed_folders = sorted(cached.keys())
+
+    return plan
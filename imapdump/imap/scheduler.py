@@ -0,0 +1,154 @@
+import json
+import logging
+import threading
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import asdict
+from datetime import datetime
+
+from ..config.imapdump_config import ImapDumpConfig
+from ..utils.rate_limiter import BandwidthLimiter
+from .dump_result import AccountResult
+from .dumper import DumpCancelledError, ImapDumper
+
+
+class AccountScheduler:
+    """
+    Runs the dumps of many accounts inside a single process while keeping the number of open
+    IMAP connections below a global and a per host limit. All accounts share one write bandwidth budget.
+    """
+
+    _accounts: dict[str, ImapDumpConfig]
+    _max_connections: int
+    _max_connections_per_host: int
+    _write_limiter: BandwidthLimiter
+    _stop_event: threading.Event
+    _logger: logging.Logger
+
+    def __init__(
+        self,
+        accounts: dict[str, ImapDumpConfig],
+        *,
+        max_connections: int,
+        max_connections_per_host: int,
+        max_write_bytes_per_second: int = 0,
+    ) -> None:
+        self._accounts = accounts
+        self._max_connections = max_connections
+        self._max_connections_per_host = max_connections_per_host
+        self._write_limiter = BandwidthLimiter(max_write_bytes_per_second)
+        self._stop_event = threading.Event()
+        self._logger = logging.getLogger(__name__)
+
+    def run(self) -> list[AccountResult]:
+        self._logger.info(
+            f"Dumping {len(self._accounts)} account(s) with at most {self._max_connections} connection(s) "
+            f"({self._max_connections_per_host} per host)"
+        )
+
+        pending = list(self._accounts.items())
+        running: dict[Future, str] = {}
+        host_usage = Counter()
+        results = []
+
+        # not used as a context manager, leaving that would wait for every running account on Ctrl-C
+        executor = ThreadPoolExecutor(max_workers=self._max_connections)
+
+        try:
+            while pending or running:
+                # start as many accounts as the limits allow, skipping over hosts that are saturated
+                for name, config in list(pending):
+                    if len(running) >= self._max_connections:
+                        break
+
+                    if host_usage[config.host] >= self._max_connections_per_host:
+                        continue
+
+                    pending.remove((name, config))
+                    host_usage[config.host] += 1
+                    future = executor.submit(self._run_account, name, config)
+                    running[future] = config.host
+
+                done, _ = wait(running.keys(), return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    host_usage[running.pop(future)] -= 1
+                    results.append(future.result())
+        except KeyboardInterrupt:
+            self._logger.info(
+                f"Interrupted, stopping {len(running)} running and cancelling {len(pending)} pending account(s)"
+            )
+            # running dumps stop after their current batch
+            self._stop_event.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+
+        executor.shutdown()
+
+        return results
+
+    def _run_account(self, name: str, config: ImapDumpConfig) -> AccountResult:
+        account_result = AccountResult(
+            name=name,
+            host=config.host,
+            username=config.username,
+            started=datetime.now(),
+        )
+        start = time.monotonic()
+
+        try:
+            dumper = ImapDumper(
+                config=config,
+                name=name,
+                write_limiter=self._write_limiter,
+                stop_event=self._stop_event,
+            )
+            account_result.result = dumper.dump()
+            account_result.success = True
+        except DumpCancelledError as e:
+            self._logger.info(f"Dumping account '{name}' was stopped")
+            account_result.error = repr(e)
+        except Exception as e:
+            self._logger.exception(f"Dumping account '{name}' failed")
+            account_result.error = repr(e)
+        finally:
+            account_result.duration = time.monotonic() - start
+
+        return account_result
+
+    @staticmethod
+    def report(results: list[AccountResult], report_file: str = None):
+        logger = logging.getLogger(__name__).getChild("report")
+
+        failed = [r for r in results if not r.success]
+        written = sum(r.result.written for r in results if r.result)
+        written_byte = sum(r.result.written_byte for r in results if r.result)
+
+        for r in sorted(results, key=lambda r: r.name):
+            if r.success:
+                logger.info(
+                    f"'{r.name}': dumped {r.result.written} message(s) ({r.result.written_byte:,} byte), "
+                    f"{r.result.skipped} already dumped, took {r.duration:.1f}s"
+                )
+            else:
+                logger.error(f"'{r.name}': failed after {r.duration:.1f}s: {r.error}")
+
+        logger.info(
+            f"{len(results) - len(failed)}/{len(results)} account(s) succeeded, "
+            f"dumped {written} message(s) ({written_byte:,} byte) in total"
+        )
+
+        if report_file:
+            report = {
+                "accounts": len(results),
+                "failed": len(failed),
+                "written": written,
+                "written_byte": written_byte,
+                "results": [asdict(r) for r in results],
+            }
+
+            with open(report_file, mode="w") as f:
+                json.dump(report, f, indent=4, default=str)
+
+            logger.info(f"Wrote report to '{report_file}'")
@@ -0,0 +1,49 @@
+import re
+from datetime import date, timedelta
+
+from ..config.imapdump_config import ImapDumpConfig
+
+_relative_days = re.compile(r"^(\d+)d$")
+
+
+def parse_date(value: str) -> date:
+    """
+    Parses either an ISO date (2024-01-31) or a number of days relative to today (90d)
+    """
+    match = _relative_days.match(value.strip())
+    if match:
+        return date.today() - timedelta(days=int(match.group(1)))
+
+    return date.fromisoformat(value.strip())
+
+
+def build_search_criteria(config: ImapDumpConfig) -> list:
+    """
+    Turns the filter settings of the given config into IMAP SEARCH criteria.
+    Returns an empty list if no filter is configured.
+    """
+    criteria = []
+
+    if config.search_since:
+        criteria += ["SINCE", parse_date(config.search_since)]
+
+    if config.search_before:
+        criteria += ["BEFORE", parse_date(config.search_before)]
+
+    if config.search_larger:
+        criteria += ["LARGER", config.search_larger]
+
+    if config.search_smaller:
+        criteria += ["SMALLER", config.search_smaller]
+
+    if config.search_unseen:
+        criteria += ["UNSEEN"]
+
+    for header in config.search_headers or []:
+        name, separator, value = header.partition(":")
+        if not separator or not name.strip():
+            raise ValueError(f"Header filter '{header}' has to look like 'Name: value'")
+
+        criteria += ["HEADER", name.strip(), value.strip()]
+
+    return criteria
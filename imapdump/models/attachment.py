@@ -0,0 +1,19 @@
+from datetime import datetime
+from sqlalchemy import DateTime
+from sqlalchemy.orm import Mapped
+from sqlalchemy.orm import mapped_column
+from sqlalchemy.sql import func
+from .base import Base
+
+
+class Attachment(Base):
+    __tablename__ = "attachments"
+    digest: Mapped[str] = mapped_column(primary_key=True)
+    size: Mapped[int] = mapped_column()
+    created: Mapped[datetime] = mapped_column(DateTime, default=func.now())
+
+
+class MailAttachment(Base):
+    __tablename__ = "mail_attachments"
+    mail_id: Mapped[str] = mapped_column(primary_key=True)
+    digest: Mapped[str] = mapped_column(primary_key=True, index=True)
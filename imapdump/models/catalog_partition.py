@@ -0,0 +1,17 @@
+from datetime import datetime
+from sqlalchemy import DateTime
+from sqlalchemy.orm import Mapped
+from sqlalchemy.orm import mapped_column
+from sqlalchemy.sql import func
+from .base import Base
+
+
+class CatalogPartition(Base):
+    __tablename__ = "catalog_partitions"
+    folder: Mapped[str] = mapped_column(primary_key=True)
+    month: Mapped[str] = mapped_column(primary_key=True)
+    fingerprint: Mapped[str] = mapped_column()
+    filename: Mapped[str] = mapped_column()
+    modified: Mapped[datetime] = mapped_column(
+        DateTime, onupdate=func.now(), default=func.now()
+    )
@@ -0,0 +1,17 @@
+from datetime import datetime
+from sqlalchemy import DateTime
+from sqlalchemy.orm import Mapped
+from sqlalchemy.orm import mapped_column
+from sqlalchemy.sql import func
+from .base import Base
+
+
+class HostTuning(Base):
+    __tablename__ = "host_tuning"
+    host: Mapped[str] = mapped_column(primary_key=True)
+    phase: Mapped[str] = mapped_column(primary_key=True)
+    batch_size: Mapped[int] = mapped_column()
+    bytes_per_second: Mapped[float] = mapped_column(nullable=True)
+    modified: Mapped[datetime] = mapped_column(
+        DateTime, onupdate=func.now(), default=func.now()
+    )
@@ -0,0 +1,18 @@
+from datetime import datetime
+from sqlalchemy import DateTime
+from sqlalchemy.orm import Mapped
+from sqlalchemy.orm import mapped_column
+from .base import Base
+
+
+class SyncRun(Base):
+    __tablename__ = "sync_runs"
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    started: Mapped[datetime] = mapped_column(DateTime)
+    finished: Mapped[datetime] = mapped_column(DateTime)
+    success: Mapped[bool] = mapped_column()
+    new_or_updated: Mapped[int] = mapped_column()
+    written: Mapped[int] = mapped_column()
+    written_byte: Mapped[int] = mapped_column()
+    skipped: Mapped[int] = mapped_column()
+    removed: Mapped[int] = mapped_column()
@@ -0,0 +1,108 @@
+import contextlib
+import hashlib
+
+from .backend import StorageBackend
+from .mime_splitter import SKELETON_SUFFIX, join_message
+from ..utils.hash_utils import bytehash, sized_streamhash
+
+# hidden inside of the dump folder, so it's never taken for an unknown folder in mirror mode
+ATTACHMENT_FOLDER = ".attachments"
+
+
+class AttachmentStore:
+    """
+    Content addressed store of decoded attachments, every attachment is kept once under its SHA-256 digest
+    (.attachments/<first two characters>/<digest>) no matter how many messages contain it.
+    Also reads dumped messages, joining skeletons with their attachments.
+    """
+
+    _storage: StorageBackend
+    _intact: set[str]
+
+    def __init__(self, storage: StorageBackend) -> None:
+        self._storage = storage
+        # attachments known to be intact, each existing attachment is only read once
+        self._intact = set()
+
+    def put(self, digest: str, data: bytes) -> bool:
+        """
+        Stores an attachment unless it's already there and intact. Returns whether it was written.
+        """
+        path = self._get_path(digest)
+
+        if digest in self._intact:
+            return False
+
+        if self._storage.size(path) == len(data) and self.is_intact(digest):
+            return False
+
+        self._storage.write(path, data, atomic=True)
+        self._intact.add(digest)
+        return True
+
+    def get(self, digest: str) -> bytes:
+        data = self._storage.read(self._get_path(digest))
+
+        if data is None:
+            raise FileNotFoundError(f"Attachment '{digest}' is missing")
+
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise ValueError(f"Attachment '{digest}' is corrupted")
+
+        return data
+
+    def is_intact(self, digest: str) -> bool:
+        if digest in self._intact:
+            return True
+
+        try:
+            self.get(digest)
+        except (OSError, ValueError):
+            return False
+
+        self._intact.add(digest)
+        return True
+
+    def remove(self, digest: str):
+        self._intact.discard(digest)
+        self._storage.remove(self._get_path(digest))
+
+    def read_message(self, path: str) -> bytes | None:
+        """
+        Reads a dumped message, joining it with its attachments if it was stored as a skeleton.
+        Returns None if neither the message nor its skeleton exist.
+        """
+        rfc822 = self._storage.read(path)
+        if rfc822 is not None:
+            return rfc822
+
+        skeleton = self._storage.read(path + SKELETON_SUFFIX)
+        if skeleton is not None:
+            return join_message(skeleton, self.get)
+
+        return None
+
+    def sized_message_hash(self, path: str) -> tuple[int, str] | None:
+        """
+        Returns the size and hash of a dumped message or None if it doesn't exist.
+        Plain messages are hashed in chunks, only skeletons are joined with their attachments in memory.
+        Broken skeletons (e.g. with a missing or corrupted attachment) count as missing.
+        """
+        try:
+            stream = self._storage.open_read(path)
+            if stream is not None:
+                with contextlib.closing(stream):
+                    return sized_streamhash(stream)
+
+            skeleton = self._storage.read(path + SKELETON_SUFFIX)
+            if skeleton is None:
+                return None
+
+            rfc822 = join_message(skeleton, self.get)
+        except (OSError, ValueError):
+            return None
+
+        return len(rfc822), bytehash(rfc822)
+
+    def _get_path(self, digest: str) -> str:
+        return f"{ATTACHMENT_FOLDER}/{digest[:2]}/{digest}"
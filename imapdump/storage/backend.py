@@ -0,0 +1,196 @@
+import glob
+import os
+import shutil
+import uuid
+from abc import ABC, abstractmethod
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import BinaryIO
+
+from ..config.imapdump_config import ImapDumpConfig
+from ..enums.storage_type import StorageType
+
+
+class StorageBackend(ABC):
+    """
+    Where dumped messages end up. Paths are relative to the dump folder and always use '/' as separator.
+    Writes may be asynchronous, they are only guaranteed to be stored after flush() returned.
+    """
+
+    location: str
+
+    # used to process many stored messages in parallel, e.g. when verifying
+    parallel_executor: type[Executor]
+
+    @abstractmethod
+    def list_paths(self) -> set[str]:
+        """
+        Returns all stored files and the folders containing them (e.g. 'INBOX' and 'INBOX/1_Hello.eml'),
+        except for hidden ones starting with a '.'
+        """
+
+    @abstractmethod
+    def size(self, path: str) -> int | None:
+        """
+        Returns the size of a stored file or None if it doesn't exist
+        """
+
+    @abstractmethod
+    def read(self, path: str) -> bytes | None: ...
+
+    @abstractmethod
+    def open_read(self, path: str) -> BinaryIO | None:
+        """
+        Opens a stored file for reading in chunks or returns None if it doesn't exist, the caller closes it
+        """
+
+    @abstractmethod
+    def write(
+        self, path: str, data: bytes, *, mtime: float = None, atomic: bool = False
+    ) -> int: ...
+
+    @abstractmethod
+    def remove(self, path: str): ...
+
+    @abstractmethod
+    def remove_tree(self, path: str): ...
+
+    @abstractmethod
+    def make_folder(self, path: str): ...
+
+    @abstractmethod
+    def clear(self):
+        """
+        Removes everything that's stored
+        """
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+
+class LocalStorageBackend(StorageBackend):
+    parallel_executor = ProcessPoolExecutor
+
+    _root: str
+    _known_folders: set[str]
+
+    def __init__(self, root: str) -> None:
+        self._root = root
+        self._known_folders = set()
+        self.location = root
+
+    def list_paths(self) -> set[str]:
+        if not os.path.isdir(self._root):
+            return set()
+
+        return {
+            path.replace(os.sep, "/")
+            for path in glob.glob(pathname="**", root_dir=self._root, recursive=True)
+        }
+
+    def size(self, path: str) -> int | None:
+        filename = self._get_filename(path)
+
+        if not os.path.isfile(filename):
+            return None
+
+        return os.path.getsize(filename)
+
+    def read(self, path: str) -> bytes | None:
+        try:
+            with open(self._get_filename(path), mode="rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def open_read(self, path: str) -> BinaryIO | None:
+        try:
+            return open(self._get_filename(path), mode="rb")
+        except FileNotFoundError:
+            return None
+
+    def write(
+        self, path: str, data: bytes, *, mtime: float = None, atomic: bool = False
+    ) -> int:
+        filename = self._get_filename(path)
+        self.make_folder(os.path.dirname(path))
+
+        # several processes may write the same file at once, readers never see it half written
+        written_filename = f"{filename}.{uuid.uuid4().hex}.tmp" if atomic else filename
+
+        with open(written_filename, mode="wb") as f:
+            written = f.write(data)
+
+        if atomic:
+            os.replace(written_filename, filename)
+
+        if mtime is not None:
+            os.utime(filename, (mtime, mtime))
+
+        return written
+
+    def remove(self, path: str):
+        try:
+            os.remove(self._get_filename(path))
+        except FileNotFoundError:
+            pass
+
+    def remove_tree(self, path: str):
+        shutil.rmtree(self._get_filename(path), ignore_errors=True)
+        self._known_folders.clear()
+
+    def make_folder(self, path: str):
+        if path in self._known_folders:
+            return
+
+        os.makedirs(self._get_filename(path), exist_ok=True)
+        self._known_folders.add(path)
+
+    def clear(self):
+        if os.path.isdir(self._root):
+            shutil.rmtree(self._root)
+
+        self._known_folders.clear()
+        os.makedirs(self._root, exist_ok=True)
+
+    def _get_filename(self, path: str) -> str:
+        return os.path.join(self._root, path)
+
+
+def create_storage_backend(config: ImapDumpConfig) -> StorageBackend:
+    """
+    Creates the storage backend of the given config, S3 storage uses the dump folder as key prefix
+    """
+    if config.storage == StorageType.S3:
+        from .s3_backend import S3StorageBackend
+
+        if not config.s3_bucket:
+            raise ValueError("Storing messages in S3 requires a bucket")
+
+        return S3StorageBackend(
+            bucket=config.s3_bucket,
+            prefix=config.dump_folder.strip("/"),
+            endpoint_url=config.s3_endpoint_url,
+            region=config.s3_region,
+            upload_workers=config.upload_workers,
+            multipart_threshold=config.multipart_threshold,
+        )
+
+    return LocalStorageBackend(get_storage_location(config))
+
+
+def get_storage_location(config: ImapDumpConfig) -> str:
+    """
+    Returns where messages of the given config are stored (a folder or an s3:// URL), without connecting to the storage
+    """
+    if config.storage == StorageType.S3:
+        prefix = config.dump_folder.strip("/")
+        return (
+            f"s3://{config.s3_bucket}/{prefix}/"
+            if prefix
+            else f"s3://{config.s3_bucket}/"
+        )
+
+    return os.path.abspath(os.path.expanduser(config.dump_folder.rstrip("/")))
@@ -0,0 +1,150 @@
+import base64
+import hashlib
+import json
+from collections.abc import Callable
+from email import policy
+from email.parser import BytesParser
+
+SKELETON_SUFFIX = ".skel"
+
+_skeleton_magic = b"imapdump-skeleton 1\n"
+
+
+def split_message(rfc822: bytes, min_size: int) -> tuple[bytes, dict[str, bytes]]:
+    """
+    Cuts the base64 encoded parts of at least min_size decoded bytes out of a message.
+    Returns the skeleton of the message, which references the parts by their SHA-256 digest, along with the decoded parts.
+    A part is only cut out if encoding it again reproduces the original bytes exactly,
+    so that joining the skeleton and the parts always results in the original message.
+    Returns (None, {}) if there is nothing to cut out.
+    """
+    message = BytesParser(policy=policy.compat32).parsebytes(rfc822)
+
+    spans = []
+    cursor = 0
+
+    for part in message.walk():
+        if part.is_multipart():
+            continue
+
+        encoding = str(part.get("Content-Transfer-Encoding", "")).strip().lower()
+        payload = part.get_payload()
+
+        if encoding != "base64" or not isinstance(payload, str):
+            continue
+
+        raw_payload = payload.encode("ascii", errors="surrogateescape")
+        start = rfc822.find(raw_payload, cursor)
+
+        if start < 0 or len(raw_payload) < min_size:
+            continue
+
+        cursor = start + len(raw_payload)
+        span = _parse_span(raw_payload)
+
+        if span and len(span[0]) >= min_size:
+            spans.append((start, cursor, span))
+
+    if not spans:
+        return None, {}
+
+    parts = {}
+    manifest = []
+    body = bytearray()
+    previous_end = 0
+
+    for start, end, (data, line_length, eol, suffix) in spans:
+        digest = hashlib.sha256(data).hexdigest()
+        parts[digest] = data
+
+        body += rfc822[previous_end:start]
+        manifest.append(
+            {
+                "offset": len(body),
+                "digest": digest,
+                "line_length": line_length,
+                "eol": eol.decode(),
+                "suffix": suffix.decode(),
+            }
+        )
+        previous_end = end
+
+    body += rfc822[previous_end:]
+
+    skeleton = (
+        _skeleton_magic
+        + json.dumps({"size": len(rfc822), "parts": manifest}).encode()
+        + b"\n"
+        + bytes(body)
+    )
+
+    return skeleton, parts
+
+
+def join_message(skeleton: bytes, load_part: Callable[[str], bytes]) -> bytes:
+    """
+    Rebuilds the original message from a skeleton, loading the referenced parts by their digest
+    """
+    if not skeleton.startswith(_skeleton_magic):
+        raise ValueError("Not a message skeleton")
+
+    manifest_end = skeleton.index(b"\n", len(_skeleton_magic))
+    manifest = json.loads(skeleton[len(_skeleton_magic) : manifest_end])
+    body = memoryview(skeleton)[manifest_end + 1 :]
+
+    rfc822 = bytearray()
+    previous_offset = 0
+
+    for part in manifest["parts"]:
+        rfc822 += body[previous_offset : part["offset"]]
+        rfc822 += _encode(
+            load_part(part["digest"]), part["line_length"], part["eol"].encode()
+        )
+        rfc822 += part["suffix"].encode()
+        previous_offset = part["offset"]
+
+    rfc822 += body[previous_offset:]
+
+    if len(rfc822) != manifest["size"]:
+        raise ValueError(
+            f"Joined message has {len(rfc822):,} instead of {manifest['size']:,} byte"
+        )
+
+    return bytes(rfc822)
+
+
+def _parse_span(raw_payload: bytes) -> tuple[bytes, int, bytes, bytes] | None:
+    """
+    Decodes a base64 body and detects its line layout.
+    Returns the decoded data, line length, line ending and trailing line breaks, or None if it can't be reproduced exactly.
+    """
+    core = raw_payload.rstrip(b"\r\n")
+    suffix = raw_payload[len(core) :]
+
+    newline = core.find(b"\n")
+    if newline < 0:
+        eol = b"\r\n"
+        line_length = len(core)
+    else:
+        eol = b"\r\n" if core[newline - 1 : newline] == b"\r" else b"\n"
+        line_length = newline - len(eol) + 1
+
+    if line_length <= 0:
+        return None
+
+    try:
+        data = base64.b64decode(core.replace(eol, b""), validate=True)
+    except ValueError:
+        return None
+
+    if _encode(data, line_length, eol) != core:
+        return None
+
+    return data, line_length, eol, suffix
+
+
+def _encode(data: bytes, line_length: int, eol: bytes) -> bytes:
+    encoded = base64.b64encode(data)
+    return eol.join(
+        encoded[i : i + line_length] for i in range(0, len(encoded), line_length)
+    )
@@ -0,0 +1,95 @@
+import logging
+
+from .attachment_store import AttachmentStore
+from .backend import create_storage_backend
+from .mime_splitter import SKELETON_SUFFIX, join_message
+from ..config.imapdump_config import ImapDumpConfig
+from ..db.data_service import DataService
+from ..utils.hash_utils import bytehash
+
+
+def reassemble_dump(config: ImapDumpConfig) -> int:
+    """
+    Turns all messages of the dump folder that were stored as skeletons back into complete .eml files
+    and removes the attachments that are no longer referenced. Returns the number of reassembled messages.
+    """
+    logger = logging.getLogger(__name__)
+    storage = create_storage_backend(config)
+    attachment_store = AttachmentStore(storage)
+
+    data_service = DataService(
+        connection_string=f"sqlite:///{config.database_file}",
+        dry_run=config.dry_run,
+    )
+
+    reassembled = 0
+    failed = 0
+
+    try:
+        for mail in data_service.get_all_mails():
+            skeleton_path = mail.path + SKELETON_SUFFIX
+
+            if storage.size(skeleton_path) is None:
+                continue
+
+            # left behind when the message was fetched again without deduplication
+            if storage.size(mail.path) is not None:
+                logger.info(f"Removing stale skeleton of '{mail.path}'")
+                if not config.dry_run:
+                    storage.remove(skeleton_path)
+                    data_service.save_mail_attachments(mail.id, {})
+                continue
+
+            try:
+                skeleton = storage.read(skeleton_path)
+                if skeleton is None:
+                    raise FileNotFoundError(skeleton_path)
+                rfc822 = join_message(skeleton, attachment_store.get)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Failed to reassemble '{mail.path}': {e}")
+                failed += 1
+                continue
+
+            if mail.content_hash and bytehash(rfc822) != mail.content_hash:
+                logger.warning(
+                    f"Reassembled '{mail.path}' doesn't match the recorded hash, keeping the skeleton"
+                )
+                failed += 1
+                continue
+
+            reassembled += 1
+
+            if config.dry_run:
+                continue
+
+            storage.write(
+                mail.path,
+                rfc822,
+                mtime=mail.date.timestamp() if mail.date else None,
+            )
+            storage.remove(skeleton_path)
+            data_service.save_mail_attachments(mail.id, {})
+
+            if reassembled % 1000 == 0:
+                storage.flush()
+                data_service.commit()
+                logger.info(f"Reassembled {reassembled} message(s)")
+
+        storage.flush()
+        data_service.commit()
+
+        if not config.dry_run:
+            orphans = data_service.remove_orphaned_attachments()
+            for orphan in orphans:
+                attachment_store.remove(orphan.digest)
+
+            logger.info(f"Removed {len(orphans)} attachment(s) from the store")
+    finally:
+        data_service.close_db()
+        storage.close()
+
+    logger.info(
+        f"Reassembled {reassembled} message(s) {'(SIMULATED)' if config.dry_run else ''}, {failed} failed"
+    )
+
+    return reassembled
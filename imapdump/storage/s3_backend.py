@@ -0,0 +1,278 @@
+import contextlib
+import io
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import BinaryIO
+
+from .backend import StorageBackend
+
+try:
+    import boto3
+    from boto3.s3.transfer import TransferConfig
+    from botocore.config import Config as BotoConfig
+    from botocore.exceptions import ClientError
+except ImportError as e:
+    raise ImportError(
+        "Storing messages in S3 requires boto3, install it with 'pip install imapdump[s3]'"
+    ) from e
+
+
+class S3StorageBackend(StorageBackend):
+    """
+    Stores messages as objects in an S3 compatible bucket (AWS, MinIO, Ceph, ...) below a key prefix.
+    Uploads run concurrently on a pool of threads sharing one client and its connection pool, large objects
+    are uploaded in parts. The bucket is listed once, existence and mirror checks are answered from that listing.
+    Credentials are taken from the usual AWS environment variables, config files or instance profiles.
+    """
+
+    parallel_executor = ThreadPoolExecutor
+
+    DELETE_BATCH_SIZE: int = 1000
+
+    _bucket: str
+    _prefix: str
+    _client = None
+    _transfer_config: TransferConfig
+    _executor: ThreadPoolExecutor
+    _in_flight: threading.BoundedSemaphore
+    _lock: threading.Lock
+    _pending: dict[str, Future]
+    _errors: list[Exception]
+    _deletions: set[str]
+    _listing: dict[str, int] = None
+    _logger: logging.Logger
+
+    def __init__(
+        self,
+        *,
+        bucket: str,
+        prefix: str = "",
+        endpoint_url: str = None,
+        region: str = None,
+        upload_workers: int = 16,
+        multipart_threshold: int = 8 * 1024 * 1024,
+    ) -> None:
+        self._bucket = bucket
+        self._prefix = f"{prefix}/" if prefix else ""
+        self._logger = logging.getLogger(__name__)
+        self.location = f"s3://{bucket}/{self._prefix}"
+
+        self._client = boto3.session.Session().client(
+            "s3",
+            endpoint_url=endpoint_url,
+            region_name=region,
+            config=BotoConfig(
+                # every upload may use several connections for its parts
+                max_pool_connections=upload_workers * 2,
+                retries={"max_attempts": 10, "mode": "adaptive"},
+            ),
+        )
+        self._transfer_config = TransferConfig(
+            multipart_threshold=multipart_threshold,
+            multipart_chunksize=multipart_threshold,
+            max_concurrency=2,
+        )
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=upload_workers, thread_name_prefix="s3-upload"
+        )
+        # bounds the memory held by queued uploads
+        self._in_flight = threading.BoundedSemaphore(upload_workers * 4)
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._errors = []
+        self._deletions = set()
+
+        self._logger.info(f"Storing messages in '{self.location}'")
+
+    def list_paths(self) -> set[str]:
+        paths = set()
+
+        for path in self._get_listing().keys():
+            # hidden like on the local disk, e.g. the attachment store
+            if any(part.startswith(".") for part in path.split("/")):
+                continue
+
+            paths.add(path)
+
+            # S3 doesn't know folders, derive them from the keys
+            folder, _, _ = path.rpartition("/")
+            while folder and folder not in paths:
+                paths.add(folder)
+                folder, _, _ = folder.rpartition("/")
+
+        return paths
+
+    def size(self, path: str) -> int | None:
+        return self._get_listing().get(path)
+
+    def read(self, path: str) -> bytes | None:
+        body = self.open_read(path)
+
+        if body is None:
+            return None
+
+        with contextlib.closing(body):
+            return body.read()
+
+    def open_read(self, path: str) -> BinaryIO | None:
+        self._wait_for(path)
+
+        try:
+            response = self._client.get_object(
+                Bucket=self._bucket, Key=self._get_key(path)
+            )
+            return response["Body"]
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ["NoSuchKey", "404"]:
+                return None
+            raise
+
+    def write(
+        self, path: str, data: bytes, *, mtime: float = None, atomic: bool = False
+    ) -> int:
+        # objects only become visible once they were uploaded completely, so every write is atomic
+        extra_args = {}
+        if mtime is not None:
+            extra_args["Metadata"] = {"mtime": str(int(mtime))}
+
+        self._raise_errors()
+        self._wait_for(path)
+        self._in_flight.acquire()
+
+        try:
+            future = self._executor.submit(self._upload, path, data, extra_args)
+        except Exception:
+            self._in_flight.release()
+            raise
+
+        with self._lock:
+            self._pending[path] = future
+            self._get_listing()[path] = len(data)
+            # a queued deletion must not remove the object once it was uploaded again
+            self._deletions.discard(self._get_key(path))
+
+        future.add_done_callback(lambda f: self._on_uploaded(path, f))
+        return len(data)
+
+    def remove(self, path: str):
+        self._wait_for(path)
+
+        with self._lock:
+            self._get_listing().pop(path, None)
+            self._deletions.add(self._get_key(path))
+            batch_full = len(self._deletions) >= self.DELETE_BATCH_SIZE
+
+        if batch_full:
+            self._delete_pending()
+
+    def remove_tree(self, path: str):
+        for stored_path in [
+            p for p in self._get_listing().keys() if p.startswith(f"{path}/")
+        ]:
+            self.remove(stored_path)
+
+    def make_folder(self, path: str):
+        # folders only exist as part of object keys
+        pass
+
+    def clear(self):
+        for path in list(self._get_listing().keys()):
+            self.remove(path)
+
+        self._delete_pending()
+
+    def flush(self):
+        with self._lock:
+            pending = list(self._pending.values())
+
+        for future in pending:
+            future.exception()
+
+        self._delete_pending()
+        self._raise_errors()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self._executor.shutdown(wait=True)
+            self._client.close()
+
+    def _upload(self, path: str, data: bytes, extra_args: dict):
+        self._client.upload_fileobj(
+            io.BytesIO(data),
+            self._bucket,
+            self._get_key(path),
+            ExtraArgs=extra_args,
+            Config=self._transfer_config,
+        )
+
+    def _on_uploaded(self, path: str, future: Future):
+        self._in_flight.release()
+
+        with self._lock:
+            if self._pending.get(path) is future:
+                del self._pending[path]
+
+            if future.exception() is not None:
+                self._errors.append(future.exception())
+                self._get_listing().pop(path, None)
+
+    def _wait_for(self, path: str):
+        """
+        Waits for a pending upload of the same path, so operations on a path are applied in order
+        """
+        with self._lock:
+            future = self._pending.get(path)
+
+        if future is not None:
+            future.exception()
+
+    def _delete_pending(self):
+        with self._lock:
+            deletions = sorted(self._deletions)
+            self._deletions = set()
+
+        for start in range(0, len(deletions), self.DELETE_BATCH_SIZE):
+            response = self._client.delete_objects(
+                Bucket=self._bucket,
+                Delete={
+                    "Objects": [
+                        {"Key": key}
+                        for key in deletions[start : start + self.DELETE_BATCH_SIZE]
+                    ],
+                    "Quiet": True,
+                },
+            )
+
+            for error in response.get("Errors", []):
+                self._logger.warning(
+                    f"Failed to delete '{error['Key']}': {error.get('Message')}"
+                )
+
+    def _raise_errors(self):
+        with self._lock:
+            errors = self._errors
+            self._errors = []
+
+        if errors:
+            raise errors[0]
+
+    def _get_listing(self) -> dict[str, int]:
+        if self._listing is None:
+            listing = {}
+            paginator = self._client.get_paginator("list_objects_v2")
+
+            for page in paginator.paginate(Bucket=self._bucket, Prefix=self._prefix):
+                for entry in page.get("Contents", []):
+                    listing[entry["Key"][len(self._prefix) :]] = entry["Size"]
+
+            self._listing = listing
+            self._logger.debug(f"Listed {len(listing)} object(s) in '{self.location}'")
+
+        return self._listing
+
+    def _get_key(self, path: str) -> str:
+        return f"{self._prefix}{path}"
@@ -1,10 +1,22 @@
 import hashlib
+from typing import BinaryIO
 
-
-def filehash(filename: str) -> str:
-    with open(filename, "rb", buffering=0) as f:
-        return hashlib.file_digest(f, "md5").hexdigest()
+HASH_CHUNK_SIZE: int = 1024 * 1024
 
 
 def bytehash(byteobject) -> str:
     return hashlib.md5(byteobject).hexdigest()
+
+
+def sized_streamhash(stream: BinaryIO) -> tuple[int, str]:
+    """
+    Returns the size and hash of everything read from the given stream, without holding it in memory at once
+    """
+    digest = hashlib.md5()
+    size = 0
+
+    while chunk := stream.read(HASH_CHUNK_SIZE):
+        digest.update(chunk)
+        size += len(chunk)
+
+    return size, digest.hexdigest()
@@ -0,0 +1,72 @@
+import html
+import re
+from email import policy
+from email.message import EmailMessage
+from email.parser import BytesParser
+from email.utils import getaddresses
+
+_html_tags = re.compile(r"<(script|style)\b.*?</\1>|<[^>]+>", re.DOTALL | re.IGNORECASE)
+_whitespace = re.compile(r"\s+")
+
+_address_headers = ["From", "Sender", "Reply-To", "To", "Cc", "Bcc"]
+
+
+def html_to_text(html_string: str) -> str:
+    return _whitespace.sub(" ", html.unescape(_html_tags.sub(" ", html_string))).strip()
+
+
+def extract_search_document(rfc822: bytes) -> dict[str, str]:
+    """
+    Extracts the searchable parts of a message: subject, addresses, decoded text bodies and attachment names.
+    HTML bodies are only used if a message has no plain text body.
+    """
+    message: EmailMessage = BytesParser(policy=policy.default).parsebytes(rfc822)
+
+    addresses = []
+    for header in _address_headers:
+        try:
+            values = message.get_all(header, [])
+            for name, address in getaddresses([str(value) for value in values]):
+                addresses.append(f"{name} <{address}>" if name else address)
+        except Exception:
+            continue
+
+    plain_bodies = []
+    html_bodies = []
+    attachments = []
+
+    for part in message.walk():
+        if part.is_multipart():
+            continue
+
+        filename = part.get_filename()
+        if filename or part.get_content_disposition() == "attachment":
+            if filename:
+                attachments.append(filename)
+            continue
+
+        content_type = part.get_content_type()
+        if content_type not in ["text/plain", "text/html"]:
+            continue
+
+        try:
+            content = part.get_content()
+        except Exception:
+            content = (part.get_payload(decode=True) or b"").decode(errors="ignore")
+
+        if content_type == "text/plain":
+            plain_bodies.append(content)
+        else:
+            html_bodies.append(html_to_text(content))
+
+    try:
+        subject = str(message.get("Subject", ""))
+    except Exception:
+        subject = ""
+
+    return {
+        "subject": subject,
+        "addresses": " ".join(addresses),
+        "body": "\n".join(plain_bodies or html_bodies),
+        "attachments": " ".join(attachments),
+    }
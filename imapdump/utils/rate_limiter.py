@@ -0,0 +1,37 @@
+import threading
+import time
+
+
+class BandwidthLimiter:
+    """
+    Token bucket shared between threads. A rate of 0 disables limiting.
+    Requests larger than the bucket are allowed but put the bucket into debt,
+    so following callers wait until it has been paid off.
+    """
+
+    _rate: int
+    _tokens: float
+    _last: float
+    _lock: threading.Lock
+
+    def __init__(self, bytes_per_second: int) -> None:
+        self._rate = bytes_per_second
+        self._tokens = bytes_per_second
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, amount: int):
+        if self._rate <= 0:
+            return
+
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self._rate, self._tokens + (now - self._last) * self._rate
+            )
+            self._last = now
+            self._tokens -= amount
+            wait = -self._tokens / self._rate if self._tokens < 0 else 0
+
+        if wait > 0:
+            time.sleep(wait)
@@ -1,17 +1,21 @@
+import re
+import unicodedata
+from email.header import decode_header, make_header
 from imapclient.response_types import Envelope, Address
 
 _max_length = 255 - len(".eml")
+_filename_trash = re.compile(r"[^a-zA-Z0-9_\-]+")
 
 
 def envelope_to_msg_title(envelope: Envelope) -> str:
     ret_str_arr = []
 
     if envelope.subject:
-        ret_str_arr.append(envelope.subject.decode())
+        ret_str_arr.append(decode_header_value(envelope.subject))
 
-    ret_str_arr.append(
-        addr_to_str(envelope.sender if envelope.sender else envelope.from_)
-    )
+    sender = addr_to_str(envelope.sender if envelope.sender else envelope.from_)
+    if sender:
+        ret_str_arr.append(sender)
 
     if envelope.date:
         ret_str_arr.append(str(int(envelope.date.timestamp())))
@@ -35,12 +39,71 @@ def addr_to_str(addresses: tuple[Address]) -> str:
     addr_str = ""
 
     if addr.mailbox:
-        addr_str += addr.mailbox.decode()
+        addr_str += decode_header_value(addr.mailbox)
 
     if addr.host:
-        addr_str += f"@{addr.host.decode()}"
+        addr_str += f"@{decode_header_value(addr.host)}"
 
     if addr.name:
-        addr_str = f"{addr.name.decode()} <{addr_str}>"
+        addr_str = f"{decode_header_value(addr.name)} <{addr_str}>"
 
     return addr_str
+
+
+def sanitize_filename(unicode_string: str, truncate_length: int = 32) -> str:
+    """
+    Reduces a string to letters, numbers, underscores and dashes for use in a filename, truncated to a fixed length.
+    Accented characters are replaced by their ASCII base character, all other non-ASCII characters are dropped.
+    """
+    ascii_string = (
+        unicodedata.normalize("NFKD", unicode_string)
+        .encode("ascii", errors="ignore")
+        .decode()
+    )
+
+    # replace spaces with underscores
+    ascii_string = ascii_string.replace(" ", "_")
+    # remove everything that's not a letter, a number, an underscore or a dash
+    ascii_string = _filename_trash.sub("", ascii_string)
+    return ascii_string[:truncate_length].rstrip("_")
+
+
+def decode_header_value(value: bytes) -> str:
+    """
+    Decodes a raw header value as returned in an ENVELOPE, including MIME encoded words (=?utf-8?q?...?=)
+    """
+    if not value:
+        return ""
+
+    text = value.decode(errors="replace")
+
+    try:
+        return str(make_header(decode_header(text)))
+    except Exception:
+        return text
+
+
+def addresses_to_str(addresses: tuple[Address]) -> str:
+    """
+    Formats all addresses of an ENVELOPE field as a comma separated list, e.g. 'Alice <alice@example.com>, bob@example.com'
+    """
+    if not addresses:
+        return None
+
+    addr_strs = []
+
+    for addr in addresses:
+        # group syntax markers don't have a host
+        if not addr.mailbox or not addr.host:
+            continue
+
+        addr_str = (
+            f"{decode_header_value(addr.mailbox)}@{decode_header_value(addr.host)}"
+        )
+
+        if addr.name:
+            addr_str = f"{decode_header_value(addr.name)} <{addr_str}>"
+
+        addr_strs.append(addr_str)
+
+    return ", ".join(addr_strs) or None
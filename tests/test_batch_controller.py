@@ -0,0 +1,66 @@
+import pytest
+
+from imapdump.imap.batch_controller import AdaptiveBatchController
+
+
+def create_controller(initial: int = 100) -> AdaptiveBatchController:
+    return AdaptiveBatchController(
+        "test", initial=initial, minimum=10, maximum=1000, target_seconds=5.0
+    )
+
+
+def test_invalid_bounds_are_rejected():
+    with pytest.raises(ValueError):
+        AdaptiveBatchController(
+            "test", initial=10, minimum=100, maximum=10, target_seconds=5.0
+        )
+
+
+def test_initial_size_is_clamped():
+    assert create_controller(initial=5000).batch_size == 1000
+    assert create_controller(initial=1).batch_size == 10
+
+
+def test_fast_batches_grow_at_most_twofold():
+    controller = create_controller()
+
+    controller.record(100, 0.1)
+
+    assert controller.batch_size == 200
+
+
+def test_slow_batches_shrink_at_most_by_half():
+    controller = create_controller()
+
+    controller.record(100, 600.0)
+
+    assert controller.batch_size == 50
+
+
+def test_partial_batches_are_ignored():
+    controller = create_controller()
+
+    controller.record(10, 0.1)
+
+    assert controller.batch_size == 100
+
+
+def test_growth_is_undone_if_throughput_dropped():
+    controller = create_controller()
+
+    controller.record(100, 1.0, 10_000_000)
+    assert controller.batch_size == 200
+
+    controller.record(200, 4.0, 10_000_000)
+    assert controller.batch_size == 100
+
+
+def test_shrink_halves_failed_batch_down_to_minimum():
+    controller = create_controller()
+
+    controller.shrink(100)
+    assert controller.batch_size == 50
+
+    for _ in range(10):
+        controller.shrink(controller.batch_size)
+    assert controller.batch_size == controller.minimum
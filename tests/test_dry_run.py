@@ -0,0 +1,150 @@
+import sqlite3
+from datetime import datetime
+
+import pytest
+
+from imapdump.config.imapdump_config import ImapDumpConfig
+from imapdump.db.data_service import DataService
+from imapdump.imap import dumper
+from imapdump.imap.dumper import ImapDumper
+from imapdump.models.mail import Mail
+
+
+def make_mail(folder: str, uid: int) -> Mail:
+    mail = Mail()
+    mail.id = Mail.generate_id(folder_name=folder, message_id=uid)
+    mail.uid = uid
+    mail.folder = folder
+    mail.title = f"Message {uid}"
+    mail.size = 100
+    mail.path = Mail.generate_path(folder_name=folder, id=mail.id, title=mail.title)
+    return mail
+
+
+@pytest.fixture
+def cache(tmp_path) -> str:
+    database_file = str(tmp_path / "cache.db")
+
+    data_service = DataService(connection_string=f"sqlite:///{database_file}")
+    data_service.save_and_commit(make_mail("INBOX", 1))
+    data_service.close_db()
+
+    return database_file
+
+
+def table_names(database_file: str) -> set[str]:
+    connection = sqlite3.connect(database_file)
+    try:
+        return {
+            name
+            for (name,) in connection.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table'"
+            )
+        }
+    finally:
+        connection.close()
+
+
+def read_bytes(path: str) -> bytes:
+    with open(path, mode="rb") as f:
+        return f.read()
+
+
+def test_dry_run_rolls_back_changes_and_ddl(cache):
+    before = read_bytes(cache)
+    assert "mails_fts_docs" not in table_names(cache)
+
+    # creating the full text index is DDL on top of the regular changes
+    data_service = DataService(
+        connection_string=f"sqlite:///{cache}", dry_run=True, fulltext_index=True
+    )
+    assert data_service.has_fulltext_index
+    data_service.save_and_commit(make_mail("INBOX", 2))
+    data_service.save_host_tuning("imap.example.com", "cache", 500, 1000.0)
+    data_service.commit()
+    assert len(data_service.get_all_mails()) == 2
+    data_service.close_db()
+
+    assert read_bytes(cache) == before
+    assert "mails_fts_docs" not in table_names(cache)
+
+    data_service = DataService(connection_string=f"sqlite:///{cache}")
+    assert [mail.uid for mail in data_service.get_all_mails()] == ["1"]
+    data_service.close_db()
+
+
+def test_dry_run_recreate_keeps_the_cache(cache):
+    before = read_bytes(cache)
+
+    data_service = DataService(
+        connection_string=f"sqlite:///{cache}", dry_run=True, recreate=True
+    )
+    assert data_service.get_all_mails() == []
+    data_service.close_db()
+
+    assert read_bytes(cache) == before
+
+
+class FakeClient:
+    """
+    Serves a single folder with a few messages, just enough for a dump
+    """
+
+    def __init__(self) -> None:
+        self._messages = {
+            uid: f"Subject: Message {uid}\r\n\r\nHello {uid}\r\n".encode()
+            for uid in range(1, 6)
+        }
+
+    def list_folders(self):
+        return [((), b"/", "INBOX")]
+
+    def select_folder(self, folder, readonly=False):
+        return {b"EXISTS": len(self._messages)}
+
+    def search(self, criteria="ALL"):
+        return sorted(self._messages)
+
+    def fetch(self, messages, data):
+        response = {}
+        # the cache keeps uids as strings
+        for uid in map(int, messages):
+            raw = self._messages[uid]
+            response[uid] = {
+                b"RFC822.SIZE": len(raw),
+                b"INTERNALDATE": datetime(2024, 1, 1),
+                b"ENVELOPE": None,
+                b"RFC822": raw,
+            }
+        return response
+
+    def idle(self):
+        pass
+
+    def idle_done(self):
+        pass
+
+    def logout(self):
+        pass
+
+
+def test_dry_run_dump_writes_nothing(cache, tmp_path, monkeypatch):
+    monkeypatch.setattr(dumper, "connect", lambda config, logger: FakeClient())
+
+    dump_folder = tmp_path / "dump"
+    dump_folder.mkdir()
+    before = read_bytes(cache)
+
+    config = ImapDumpConfig(
+        host="imap.example.com",
+        database_file=cache,
+        dump_folder=str(dump_folder),
+        fulltext_index=True,
+        dry_run=True,
+    )
+    result = ImapDumper(config=config).dump()
+
+    assert result.written == 5
+    assert list(dump_folder.iterdir()) == []
+    assert read_bytes(cache) == before
+    assert "mails_fts_docs" not in table_names(cache)
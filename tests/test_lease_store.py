@@ -0,0 +1,120 @@
+import pytest
+
+from imapdump.db.lease_store import LeaseStore, LeaseUnit
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = LeaseStore(str(tmp_path / "coordination.db"))
+    yield store
+    store.close()
+
+
+def register(store: LeaseStore, run: str = "run") -> list[LeaseUnit]:
+    units = [
+        LeaseUnit(run, "INBOX", 1, 100),
+        LeaseUnit(run, "INBOX", 101, None),
+    ]
+    store.register_units(units)
+    return units
+
+
+def test_claim_hands_out_every_unit_once(store):
+    register(store)
+
+    first = store.claim("run", "node-1", 600)
+    second = store.claim("run", "node-2", 600)
+
+    assert (first.folder, first.uid_start) == ("INBOX", 1)
+    assert (second.folder, second.uid_start) == ("INBOX", 101)
+    assert store.claim("run", "node-3", 600) is None
+
+
+def test_folders_are_only_split_once_per_run(store):
+    register(store)
+    store.register_units([LeaseUnit("run", "INBOX", 1, None)])
+
+    assert store.get_progress("run") == (0, 2)
+
+
+def test_expired_lease_is_handed_out_again(store):
+    register(store)
+
+    # a negative lease expires right away, like the lease of a crashed node
+    lost = store.claim("run", "node-1", -1)
+    taken_over = store.claim("run", "node-2", 600)
+
+    assert (taken_over.folder, taken_over.uid_start) == (lost.folder, lost.uid_start)
+
+
+def test_renewal_fails_after_another_node_took_over(store):
+    register(store)
+
+    unit = store.claim("run", "node-1", -1)
+    store.claim("run", "node-2", 600)
+
+    assert not store.renew(unit, "node-1", 600)
+
+    # completing a lost unit doesn't mark it as done
+    store.complete(unit, "node-1")
+    assert store.get_progress("run") == (0, 2)
+
+
+def test_renewal_keeps_the_lease(store):
+    register(store)
+
+    unit = store.claim("run", "node-1", 600)
+
+    assert store.renew(unit, "node-1", 600)
+
+    store.complete(unit, "node-1")
+    assert store.get_progress("run") == (1, 2)
+
+
+def test_database_file_of_active_node_is_rejected(store):
+    store.register_node("node-1", "/shared/cache.db", "dump", 600)
+
+    with pytest.raises(ValueError):
+        store.register_node("node-2", "/shared/cache.db", "dump", 600)
+
+    assert store.get_node_database_files() == {"node-1": "/shared/cache.db"}
+
+
+def test_database_file_of_finished_node_is_taken_over(store):
+    store.register_node("node-1", "/shared/cache.db", "dump", 600)
+    store.finish_node("node-1")
+
+    store.register_node("node-2", "/shared/cache.db", "dump", 600)
+
+    assert store.get_node_database_files() == {"node-2": "/shared/cache.db"}
+
+
+def finish_run(store: LeaseStore, run: str, assignments: dict[str, str]):
+    """
+    Lets the given nodes (uid_start -> node) finish all units of a run
+    """
+    for unit in register(store, run):
+        node = assignments[unit.uid_start]
+        claimed = store.claim(run, node, 600)
+        store.complete(claimed, node)
+
+
+def test_nodes_prefer_units_they_finished_before(store):
+    finish_run(store, "first", {1: "node-1", 101: "node-2"})
+    register(store, "second")
+
+    # node-2 starts first, but leaves the unit in node-1's cache alone
+    assert store.claim("second", "node-2", 600).uid_start == 101
+    assert store.claim("second", "node-1", 600).uid_start == 1
+
+
+def test_units_of_other_nodes_are_taken_over_last(store):
+    finish_run(store, "first", {1: "node-1", 101: "node-1"})
+    register(store, "second")
+    store.register_units([LeaseUnit("second", "Sent", 1, None)])
+
+    unit = store.claim("second", "node-2", 600)
+    assert unit.folder == "Sent"
+
+    store.complete(unit, "node-2")
+    assert store.claim("second", "node-2", 600).folder == "INBOX"
@@ -0,0 +1,102 @@
+import hashlib
+import random
+from email import policy
+from email.message import EmailMessage
+
+import pytest
+
+from imapdump.storage.attachment_store import AttachmentStore
+from imapdump.storage.backend import LocalStorageBackend
+from imapdump.storage.mime_splitter import join_message, split_message
+from imapdump.utils.hash_utils import bytehash
+
+ATTACHMENT = random.Random(1).randbytes(200_000)
+
+
+def create_message(attachment: bytes, message_policy=policy.default) -> bytes:
+    message = EmailMessage()
+    message["Subject"] = "Quarterly report"
+    message["From"] = "alice@example.com"
+    message["To"] = "bob@example.com"
+    message.set_content("See attached")
+    message.add_attachment(
+        attachment, maintype="application", subtype="pdf", filename="report.pdf"
+    )
+    return message.as_bytes(policy=message_policy)
+
+
+@pytest.mark.parametrize(
+    "message_policy", [policy.default, policy.SMTP], ids=["lf", "crlf"]
+)
+def test_split_and_join_is_byte_identical(message_policy):
+    rfc822 = create_message(ATTACHMENT, message_policy)
+
+    skeleton, parts = split_message(rfc822, 65536)
+
+    assert skeleton is not None
+    assert list(parts.values()) == [ATTACHMENT]
+    assert len(skeleton) < len(rfc822) - len(ATTACHMENT)
+    assert join_message(skeleton, parts.__getitem__) == rfc822
+
+
+def test_same_attachment_has_same_digest():
+    _, first = split_message(create_message(ATTACHMENT), 65536)
+    _, second = split_message(create_message(ATTACHMENT, policy.SMTP), 65536)
+
+    assert first.keys() == second.keys() == {hashlib.sha256(ATTACHMENT).hexdigest()}
+
+
+def test_small_attachments_are_kept():
+    assert split_message(create_message(ATTACHMENT[:1000]), 65536) == (None, {})
+
+
+def test_join_rejects_a_wrong_part():
+    skeleton, parts = split_message(create_message(ATTACHMENT), 65536)
+
+    with pytest.raises(ValueError):
+        join_message(skeleton, lambda digest: ATTACHMENT[:-10])
+
+
+def test_store_reads_skeletons_transparently(tmp_path):
+    storage = LocalStorageBackend(str(tmp_path))
+    store = AttachmentStore(storage)
+    rfc822 = create_message(ATTACHMENT)
+
+    skeleton, parts = split_message(rfc822, 65536)
+    for digest, data in parts.items():
+        assert store.put(digest, data)
+        assert not store.put(digest, data)
+    storage.write("INBOX/1.eml.skel", skeleton)
+
+    assert store.read_message("INBOX/1.eml") == rfc822
+    assert store.read_message("INBOX/2.eml") is None
+
+
+def test_store_repairs_a_corrupted_attachment_of_the_same_size(tmp_path):
+    digest = hashlib.sha256(ATTACHMENT).hexdigest()
+    AttachmentStore(LocalStorageBackend(str(tmp_path))).put(digest, ATTACHMENT)
+
+    path = tmp_path / ".attachments" / digest[:2] / digest
+    path.write_bytes(bytes(len(ATTACHMENT)))
+
+    store = AttachmentStore(LocalStorageBackend(str(tmp_path)))
+    assert not store.is_intact(digest)
+    assert store.put(digest, ATTACHMENT)
+    assert store.get(digest) == ATTACHMENT
+
+
+def test_store_hashes_plain_messages_and_skeletons_alike(tmp_path):
+    storage = LocalStorageBackend(str(tmp_path))
+    store = AttachmentStore(storage)
+    rfc822 = create_message(ATTACHMENT)
+
+    skeleton, parts = split_message(rfc822, 65536)
+    for digest, data in parts.items():
+        store.put(digest, data)
+    storage.write("INBOX/1.eml.skel", skeleton)
+    storage.write("INBOX/2.eml", rfc822)
+
+    expected = (len(rfc822), bytehash(rfc822))
+    assert store.sized_message_hash("INBOX/1.eml") == expected
+    assert store.sized_message_hash("INBOX/2.eml") == expected
+    assert store.sized_message_hash("INBOX/3.eml") is None
@@ -0,0 +1,106 @@
+import pytest
+
+pytest.importorskip("boto3")
+moto = pytest.importorskip("moto")
+
+import boto3  # noqa: E402
+
+from imapdump.storage.s3_backend import S3StorageBackend  # noqa: E402
+
+BUCKET = "imapdump-test"
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+
+    with moto.mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+def create_backend(**kwargs) -> S3StorageBackend:
+    return S3StorageBackend(
+        bucket=BUCKET, prefix="mail/alice", region="us-east-1", **kwargs
+    )
+
+
+def list_keys(client) -> set[str]:
+    return {
+        entry["Key"]
+        for page in client.get_paginator("list_objects_v2").paginate(Bucket=BUCKET)
+        for entry in page.get("Contents", [])
+    }
+
+
+def test_written_objects_exist_through_the_cached_listing(s3):
+    backend = create_backend()
+
+    assert backend.size("INBOX/1.eml") is None
+
+    backend.write("INBOX/1.eml", b"message", mtime=1700000000)
+    # answered from the listing before the upload finished
+    assert backend.size("INBOX/1.eml") == len(b"message")
+    assert "INBOX" in backend.list_paths()
+
+    backend.flush()
+    assert backend.read("INBOX/1.eml") == b"message"
+
+    response = s3.head_object(Bucket=BUCKET, Key="mail/alice/INBOX/1.eml")
+    assert response["Metadata"] == {"mtime": "1700000000"}
+    backend.close()
+
+    # a new run lists the bucket again
+    backend = create_backend()
+    assert backend.list_paths() == {"INBOX", "INBOX/1.eml"}
+    backend.close()
+
+
+def test_stray_objects_are_removed(s3):
+    s3.put_object(Bucket=BUCKET, Key="mail/alice/INBOX/1.eml", Body=b"message")
+    s3.put_object(Bucket=BUCKET, Key="mail/alice/Junk/stray.eml", Body=b"stray")
+    s3.put_object(Bucket=BUCKET, Key="mail/alice/.attachments/ab/abc", Body=b"part")
+    s3.put_object(Bucket=BUCKET, Key="mail/bob/INBOX/1.eml", Body=b"other")
+
+    backend = create_backend()
+
+    # hidden objects like the attachment store are never mirrored away
+    assert backend.list_paths() == {"INBOX", "INBOX/1.eml", "Junk", "Junk/stray.eml"}
+
+    backend.remove_tree("Junk")
+    backend.close()
+
+    assert list_keys(s3) == {
+        "mail/alice/INBOX/1.eml",
+        "mail/alice/.attachments/ab/abc",
+        "mail/bob/INBOX/1.eml",
+    }
+
+
+def test_rewritten_object_survives_a_queued_deletion(s3):
+    backend = create_backend()
+    backend.write("INBOX/1.eml", b"message")
+    backend.flush()
+
+    backend.remove("INBOX/1.eml")
+    backend.write("INBOX/1.eml", b"message again")
+    backend.close()
+
+    assert list_keys(s3) == {"mail/alice/INBOX/1.eml"}
+
+
+def test_large_objects_are_uploaded_in_parts(s3):
+    threshold = 5 * 1024 * 1024
+    data = bytes(range(256)) * (11 * 1024 * 1024 // 256)
+
+    backend = create_backend(multipart_threshold=threshold)
+    backend.write("INBOX/large.eml", data)
+    backend.close()
+
+    response = s3.head_object(Bucket=BUCKET, Key="mail/alice/INBOX/large.eml")
+    # multipart uploads get an ETag ending in the number of parts
+    assert response["ETag"].strip('"').endswith("-3")
+    assert response["ContentLength"] == len(data)
@@ -0,0 +1,47 @@
+import threading
+
+import pytest
+
+from imapdump.config.imapdump_config import ImapDumpConfig
+from imapdump.imap import scheduler
+from imapdump.imap.dumper import DumpCancelledError
+from imapdump.imap.scheduler import AccountScheduler
+
+
+class BlockingDumper:
+    started = threading.Event()
+    stopped = threading.Event()
+
+    def __init__(self, config, *, name, write_limiter, stop_event) -> None:
+        self._stop_event = stop_event
+
+    def dump(self):
+        BlockingDumper.started.set()
+        # stands in for a dump that would run far longer than the test
+        if not self._stop_event.wait(timeout=30):
+            raise AssertionError("Dump was never told to stop")
+        BlockingDumper.stopped.set()
+        raise DumpCancelledError("Dump was stopped")
+
+
+def test_interrupt_stops_running_dumps(monkeypatch):
+    monkeypatch.setattr(scheduler, "ImapDumper", BlockingDumper)
+
+    def interrupted_wait(futures, return_when):
+        BlockingDumper.started.wait(timeout=5)
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(scheduler, "wait", interrupted_wait)
+
+    accounts = {
+        "first": ImapDumpConfig(host="imap.example.com"),
+        "second": ImapDumpConfig(host="imap.example.com"),
+    }
+    account_scheduler = AccountScheduler(
+        accounts, max_connections=1, max_connections_per_host=1
+    )
+
+    with pytest.raises(KeyboardInterrupt):
+        account_scheduler.run()
+
+    assert BlockingDumper.stopped.wait(timeout=5)
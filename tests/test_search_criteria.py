@@ -0,0 +1,65 @@
+from datetime import date, timedelta
+
+import pytest
+
+from imapdump.config.imapdump_config import ImapDumpConfig
+from imapdump.imap.search_criteria import build_search_criteria, parse_date
+
+
+def test_parse_date_relative_days():
+    assert parse_date("90d") == date.today() - timedelta(days=90)
+    assert parse_date(" 0d ") == date.today()
+
+
+def test_parse_date_iso():
+    assert parse_date("2024-01-31") == date(2024, 1, 31)
+
+
+@pytest.mark.parametrize("value", ["90", "d", "-5d", "31.01.2024", "2024-02-30", ""])
+def test_parse_date_rejects_invalid_input(value):
+    with pytest.raises(ValueError):
+        parse_date(value)
+
+
+def test_no_filters_build_no_criteria():
+    assert build_search_criteria(ImapDumpConfig()) == []
+
+
+def test_all_filters_are_combined():
+    config = ImapDumpConfig(
+        search_since="2024-01-01",
+        search_before="30d",
+        search_larger=1024,
+        search_smaller=52428800,
+        search_unseen=True,
+        search_headers=["From: example.com", "X-Priority:1"],
+    )
+
+    assert build_search_criteria(config) == [
+        "SINCE",
+        date(2024, 1, 1),
+        "BEFORE",
+        date.today() - timedelta(days=30),
+        "LARGER",
+        1024,
+        "SMALLER",
+        52428800,
+        "UNSEEN",
+        "HEADER",
+        "From",
+        "example.com",
+        "HEADER",
+        "X-Priority",
+        "1",
+    ]
+
+
+@pytest.mark.parametrize("header", ["From example.com", ": example.com"])
+def test_invalid_header_filters_are_rejected(header):
+    with pytest.raises(ValueError):
+        build_search_criteria(ImapDumpConfig(search_headers=[header]))
+
+
+def test_invalid_date_filters_are_rejected():
+    with pytest.raises(ValueError):
+        build_search_criteria(ImapDumpConfig(search_since="yesterday"))